@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+from loguru import logger
+from pathlib import Path
+
+from gen import STRATEGIES, main
+from generate_full_61b_textbook import INTERESTS, run_all
+from pipeline import client, llm
+from pipeline.MockBackend import MockBackend
+from pipeline.RateLimiter import RateLimiter
+
+
+def measure(name:str, backend:MockBackend, fn) -> dict:
+    before = backend.stats()["requests"]
+    error = None
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests = backend.stats()["requests"] - before
+    result = {
+        "benchmark": name,
+        "wall_seconds": round(wall, 3),
+        "requests": requests,
+        "requests_per_second": round(requests / wall, 2) if wall > 0 else 0.0,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "error": error,
+    }
+    print(f"| {name} | {result['wall_seconds']:.2f}s | {requests} | {result['requests_per_second']:.1f} | {result['peak_memory_mb']:.1f} MB | {error or ''} |", flush=True)
+    return result
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--chapter", dest="chapter", help="Chapter used for the per-strategy benchmarks", default="og-textbooks/berkeley-cs61b/13.-asymptotics-i/13.1-an-introduction-to-asymptotic-analysis.md")
+    # no_recomp calls methods the personalizers no longer have (write_outline, create_overview, ...), so it is only run when asked for
+    parser.add_argument("-s", "--strategies", dest="strategies", nargs="+", help="Strategies to benchmark", default=[name for name in STRATEGIES if name != "no_recomp"], choices=list(STRATEGIES.keys()))
+    parser.add_argument("--files", dest="files", help="Number of CS61B files in the corpus driver benchmark (0 skips it)", type=int, default=12)
+    parser.add_argument("-n", "--concurrency", dest="concurrency", help="Chapter jobs running at once in the driver benchmark", type=int, default=8)
+    parser.add_argument("-w", "--section-workers", dest="section_workers", help="Number of sections refined concurrently", type=int, default=8)
+    parser.add_argument("--stage-workers", dest="stage_workers", help="Number of independent stages run concurrently", type=int, default=4)
+    parser.add_argument("--sectioner", dest="sectioner", help="How drafts are split into sections", default="llm", choices=["llm", "markdown"])
+    parser.add_argument("--latency", dest="latency", help="Mean simulated seconds per request", type=float, default=0.05)
+    parser.add_argument("--jitter", dest="jitter", help="Uniform +/- seconds added to each request's latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", dest="error_rate", help="Fraction of requests failing with a 500", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", dest="rate_limit_rate", help="Fraction of requests rejected with a 429", type=float, default=0.0)
+    parser.add_argument("--rpm", dest="rpm", help="Run the benchmarks behind a rate limiter with this requests-per-minute limit", type=int, default=None)
+    parser.add_argument("--tpm", dest="tpm", help="Run the benchmarks behind a rate limiter with this tokens-per-minute limit", type=int, default=None)
+    parser.add_argument("--max-retries", dest="max_retries", help="Client retries of failed and rate-limited requests when no limiter is set", type=int, default=5)
+    parser.add_argument("--seed", dest="seed", help="Seed of the mock backend", type=int, default=0)
+    parser.add_argument("--out", dest="out", help="Where the benchmark results are written", default="bench.json")
+    args = parser.parse_args()
+
+    backend = MockBackend(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    client.set_client(backend.client(max_retries=args.max_retries))
+    if args.rpm or args.tpm:
+        llm.set_limiter(RateLimiter(rpm=args.rpm, tpm=args.tpm))
+
+    # Pipeline logs would swamp the results table
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    # Runs write their usual output/ tree into a scratch directory that sees the real og-textbooks
+    repo = Path.cwd()
+    out = (repo / args.out).resolve()
+    scratch = tempfile.TemporaryDirectory()
+    os.chdir(scratch.name)
+    os.symlink(repo / "og-textbooks", "og-textbooks")
+
+    results = []
+    print("| Benchmark | Wall | Requests | Requests/s | Peak memory | Error |\n|---|---|---|---|---|---|")
+    for strategy_name in args.strategies:
+        results.append(measure(f"gen.py -s {strategy_name}", backend, lambda: main(args.chapter, "astrophysics", strategy_name, section_workers=args.section_workers, sectioner=args.sectioner, stage_workers=args.stage_workers)))
+
+    if args.files:
+        files = sorted(Path("og-textbooks/berkeley-cs61b").rglob("*.md"))[:args.files]
+        options = {"section_workers": args.section_workers, "analogy_store": None, "sectioner": args.sectioner, "stream": False, "stage_workers": args.stage_workers}
+        results.append(measure(f"driver ({len(files)} files x {len(INTERESTS)} interests, -n {args.concurrency})", backend, lambda: asyncio.run(run_all(files, INTERESTS, "complete", args.concurrency, options, interval=3600))))
+
+    os.chdir(repo)
+    scratch.cleanup()
+
+    with open(out, "w", encoding="utf-8") as file:
+        json.dump({"settings": vars(args), "backend": backend.stats(), "results": results}, file, indent=2)
+    print(f"Benchmark results saved in {out}")
@@ -1,14 +1,22 @@
+import json
+
 from dotenv import load_dotenv
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from datetime import datetime
 from loguru import logger
 from pathlib import Path
+from threading import Lock
+from types import SimpleNamespace
 
-from pipeline import pipeline
-from utils import read
+from pipeline import llm, pipeline
+from pipeline.ArtifactStore import read_artifact, runs
+from pipeline.Checkpoint import Checkpoint
+from pipeline.runtime import add_runtime_args, configure
 
 
-def main(content_one:str, content_two:str, user_interest:str, save_dir:str):
+def main(content_one:str, content_two:str, user_interest:str, save_dir:str, jobs:tuple=(None, None), chunk_tokens:int=None):
     # Initialize LLMs (Personalization LLM types don't matter)
     p_a_llm = pipeline.PC("A", user_interest, "", save_dir)
     p_a_llm.final_draft = content_one
@@ -16,34 +24,175 @@ def main(content_one:str, content_two:str, user_interest:str, save_dir:str):
     p_b_llm = pipeline.PS("B", user_interest, "", save_dir)
     p_b_llm.final_draft = content_two
 
-    j_llm = pipeline.Judge(user_interest, "", save_dir)
+    j_llm = pipeline.Judge(user_interest, "", save_dir, chunk_tokens=chunk_tokens)
 
     # Eval outputs
     j_llm.compare(p_a_llm, p_b_llm)
-    j_llm.score(p_a_llm)
-    j_llm.score(p_b_llm)
+    j_llm.score(p_a_llm, job=jobs[0])
+    j_llm.score(p_b_llm, job=jobs[1])
+
+
+class Tournament():
+    def __init__(self, paths:list, user_interest:str, save_dir:str, replicates:int=1, workers:int=8, chunk_tokens:int=None):
+        self.judge = pipeline.Judge(user_interest, "", save_dir, chunk_tokens=chunk_tokens)
+        self.save_dir = save_dir
+        self.replicates = replicates
+        self.workers = workers
+
+        # Entrants are named E01, E02, ... so scores land in save_dir/<name>/score.md
+        self.entrants = []
+        for i, path in enumerate(paths):
+            entrant = pipeline.PS(f"E{i + 1:02d}", user_interest, "", save_dir)
+            entrant.final_draft = read_artifact(path)
+            entrant.path = path
+            entrant.job = job_of(path)
+            entrant.wins = entrant.losses = entrant.ties = 0
+            self.entrants.append(entrant)
+
+        self.lock = Lock()
+        self.executor = None
+        self.results = {}
+        self.matches = []
+
+
+    def run(self) -> list:
+        # One pool for the whole tournament: the scores, then the replicates of each comparison
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self.executor = executor
+            logger.info(f"Scoring {len(self.entrants)} drafts...")
+            list(executor.map(lambda entrant: copy_context().run(self.judge.score, entrant, job=entrant.job), self.entrants))
+
+            logger.info(f"Ranking {len(self.entrants)} drafts with position-swapped pairwise comparisons...")
+            ranking = self._sort(self.entrants)
+        self._save(ranking)
+        return ranking
+
+
+    def _sort(self, entrants:list) -> list:
+        # Merge sort needs O(N log N) comparisons; it recurses sequentially, since only the replicates of a comparison run in parallel
+        if len(entrants) <= 1:
+            return entrants
+
+        mid = len(entrants) // 2
+        left = self._sort(entrants[:mid])
+        right = self._sort(entrants[mid:])
+
+        merged = []
+        while left and right:
+            if self._better(right[0], left[0]) > 0:
+                merged.append(right.pop(0))
+            else:
+                merged.append(left.pop(0))
+        return merged + left + right
+
+
+    def _better(self, x, y) -> int:
+        """+1 if x beats y, -1 if y beats x, 0 for a tie, over swapped-order replicates."""
+        key = (x.name, y.name)
+        with self.lock:
+            if key in self.results:
+                return self.results[key]
+
+        # Each replicate shows the pair in both orders under neutral names, and is sampled (and cached) on its own
+        orders = [order for replicate in range(self.replicates) for order in [(x, y, replicate), (y, x, replicate)]]
+        verdicts = list(self.executor.map(lambda order: copy_context().run(self._match, *order), orders))
+
+        votes = sum(1 if winner is x else -1 if winner is y else 0 for winner in verdicts)
+        if votes == 0:
+            # Fall back to the absolute scores when the pairwise judgement is split
+            votes = mean_score(x) - mean_score(y)
+        result = (votes > 0) - (votes < 0)
+
+        with self.lock:
+            self.results[key] = result
+            self.results[(y.name, x.name)] = -result
+            if result > 0:
+                x.wins += 1
+                y.losses += 1
+            elif result < 0:
+                y.wins += 1
+                x.losses += 1
+            else:
+                x.ties += 1
+                y.ties += 1
+        return result
+
+
+    def _match(self, first, second, replicate:int=0):
+        token = llm.set_sample(replicate)
+        try:
+            choice, explanation = self.judge._compare(SimpleNamespace(name="A", final_draft=first.final_draft), SimpleNamespace(name="B", final_draft=second.final_draft))
+        finally:
+            llm.reset_sample(token)
+        winner = first if choice.strip().upper() == "A" else second if choice.strip().upper() == "B" else None
+
+        with self.lock:
+            self.matches.append({"first": first.path, "second": second.path, "choice": choice, "winner": winner.path if winner else "TIE", "explanation": explanation})
+        return winner
+
+
+    def _save(self, ranking:list) -> None:
+        Path(self.save_dir).mkdir(parents=True, exist_ok=True)
+
+        leaderboard = [
+            {"rank": rank, "name": entrant.name, "path": entrant.path, "mean_score": round(mean_score(entrant), 3), "wins": entrant.wins, "losses": entrant.losses, "ties": entrant.ties}
+            for rank, entrant in enumerate(ranking, start=1)
+        ]
+        with open(f"{self.save_dir}/leaderboard.json", "w", encoding="utf-8") as file:
+            json.dump({"leaderboard": leaderboard, "matches": self.matches}, file, indent=2)
+
+        with open(f"{self.save_dir}/leaderboard.md", "w", encoding="utf-8") as file:
+            file.write("| Rank | Draft | Mean score | W | L | T |\n|---|---|---|---|---|---|\n")
+            for row in leaderboard:
+                file.write(f"| {row['rank']} | {row['path']} | {row['mean_score']}/3 | {row['wins']} | {row['losses']} | {row['ties']} |\n")
+        logger.info(f"Leaderboard of {len(ranking)} drafts ({len(self.matches)} Judge comparisons) saved in {self.save_dir}/leaderboard.md")
+
+
+def job_of(path:str) -> dict:
+    # Drafts live in <save_dir>/<name>/final_draft.md next to the run's manifest.json
+    return Checkpoint.load(Path(path).parent.parent)["job"]
+
+
+def mean_score(entrant) -> float:
+    return sum(eval["score"] for eval in entrant.judge_evals) / len(entrant.judge_evals) if entrant.judge_evals else 0.0
 
 
 if __name__ == "__main__":
     load_dotenv()
 
     parser = ArgumentParser()
-    parser.add_argument("-a", dest="content_one", help="path/to/final_draft_one.md", required=True)
-    parser.add_argument("-b", dest="content_two", help="path/to/final_draft_two.md", required=True)
+    parser.add_argument("-a", dest="content_one", help="path/to/final_draft_one.md")
+    parser.add_argument("-b", dest="content_two", help="path/to/final_draft_two.md")
     parser.add_argument("-i", "--interest", dest="interest", help="Your personal/professional interest", required=True)
+    parser.add_argument("--batch", dest="batch", nargs="+", help="Rank every final_draft.md found under these directories", default=None)
+    parser.add_argument("--replicates", dest="replicates", help="Position-swapped comparison pairs per match", type=int, default=1)
+    parser.add_argument("--workers", dest="workers", help="Number of drafts scored concurrently", type=int, default=8)
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", help="Score and compare drafts over this many tokens chunk by chunk", type=int, default=None)
+    add_runtime_args(parser)
     args = parser.parse_args()
 
+    configure(args)
+
     curr_date = datetime.now()
     save_dir = f"evals/{curr_date.year}{curr_date.month}{curr_date.day}{curr_date.time().hour}{curr_date.time().minute}{curr_date.time().second}"
 
-    # Document final draft paths
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
-    with open(f"{save_dir}/final_draft_paths.txt", "w", encoding="utf-8") as file:
-        file.write(f"A: {args.content_one}\nB: {args.content_two}")
-        logger.info(f"Final draft paths used logged in {save_dir}/final_draft_paths.txt")
+    if args.batch:
+        paths = {str(path) for directory in args.batch for path in Path(directory).rglob("final_draft.md")}
+        # Drafts of runs on the JSONL artifact store are addressed by the path an export would give them
+        paths |= {str(run_dir / name) for directory in args.batch for run_dir, artifacts in runs(directory) for name in artifacts if name.endswith("/final_draft.md")}
+        paths = sorted(paths)
+        Tournament(paths, args.interest, save_dir, replicates=args.replicates, workers=args.workers, chunk_tokens=args.chunk_tokens).run()
+    elif args.content_one and args.content_two:
+        # Document final draft paths
+        Path(save_dir).mkdir(parents=True, exist_ok=True)
+        with open(f"{save_dir}/final_draft_paths.txt", "w", encoding="utf-8") as file:
+            file.write(f"A: {args.content_one}\nB: {args.content_two}")
+            logger.info(f"Final draft paths used logged in {save_dir}/final_draft_paths.txt")
 
-    # Read final draft contents
-    content_one = read(args.content_one)
-    content_two = read(args.content_two)
+        # Read final draft contents
+        content_one = read_artifact(args.content_one)
+        content_two = read_artifact(args.content_two)
 
-    main(content_one, content_two, args.interest, save_dir)
+        main(content_one, content_two, args.interest, save_dir, jobs=(job_of(args.content_one), job_of(args.content_two)), chunk_tokens=args.chunk_tokens)
+    else:
+        parser.error("either -a and -b, or --batch, is required")
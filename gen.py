@@ -1,108 +1,130 @@
+import hashlib
+import json
+
 from dotenv import load_dotenv
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from datetime import datetime
 from loguru import logger
 from pathlib import Path
 
-from pipeline import pipeline
+from pipeline import llm, pipeline
+from pipeline.AnalogyStore import AnalogyStore
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.Checkpoint import Checkpoint
+from pipeline.Scheduler import Scheduler, Stage
+from pipeline.Usage import UsageRecorder
+from pipeline.markdown import regroup, split_sections
+from pipeline.runtime import add_runtime_args, configure, log_stats
+from pipeline.trace import Tracer, set_tracer
 from utils import read
 
 
-def no_recomp(reference_text:str, user_interest:str, save_dir:str):
+def no_recomp(reference_text:str, user_interest:str, save_dir:str, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None):
     # Initialize LLMs
-    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir)
-    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir)
-    j_llm = pipeline.Judge(user_interest, reference_text, save_dir)
-
-    # Run content-by-content Personalization LLM -- draft
-    p_a_llm.extract_concepts()
-    p_a_llm.write_outline()
-    p_a_llm.create_overview()
-    p_a_llm.personalize(with_outline=True)
+    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir, analogy_store=analogy_store)
+    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir, workers=section_workers, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+    j_llm = pipeline.Judge(user_interest, reference_text, save_dir, chunk_tokens=chunk_tokens, workers=section_workers)
 
-    # Give feedback to content-by-content Personalization LLM
-    j_llm.give_feedback(p_a_llm, PLLM_other=p_b_llm)
+    # Legacy strategy kept as a single opaque stage
+    def run():
+        # Run content-by-content Personalization LLM -- draft
+        p_a_llm.extract_concepts()
+        p_a_llm.write_outline()
+        p_a_llm.create_overview()
+        p_a_llm.personalize(with_outline=True)
 
-    # Run whole-chapter Personalization LLM -- draft
-    p_b_llm.extract_sections()
-    p_b_llm.personalize()
-    p_b_llm.create_overview()
+        # Give feedback to content-by-content Personalization LLM
+        j_llm.give_feedback(p_a_llm, PLLM_other=p_b_llm)
 
-    # Give feedback to whole-chapter Personalization LLM
-    j_llm.give_feedback(p_b_llm, PLLM_other=p_a_llm)
+        # Run whole-chapter Personalization LLM -- draft
+        p_b_llm.extract_sections()
+        p_b_llm.personalize()
+        p_b_llm.create_overview()
 
-    # Run content-by-content Personalization LLM -- refinement
-    p_a_llm.refine()
+        # Give feedback to whole-chapter Personalization LLM
+        j_llm.give_feedback(p_b_llm, PLLM_other=p_a_llm)
 
-    # Run whole-chapter Personalization LLM -- refinement
-    p_b_llm.refine()
+        # Run content-by-content Personalization LLM -- refinement
+        p_a_llm.refine()
 
-    # Compare refined drafts
-    j_llm.compare(p_a_llm, p_b_llm)
+        # Run whole-chapter Personalization LLM -- refinement
+        p_b_llm.refine()
 
-    # Score each PLLM's final drafts
-    j_llm.score(p_a_llm)
-    j_llm.score(p_b_llm)
+        # Compare refined drafts
+        j_llm.compare(p_a_llm, p_b_llm)
 
+        # Score each PLLM's final drafts
+        j_llm.score(p_a_llm)
+        j_llm.score(p_b_llm)
 
-def complete(reference_text:str, user_interest:str, save_dir:str):
-    # Initialize LLMs
-    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir)
-    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir)
-    j_llm = pipeline.Judge(user_interest, reference_text, save_dir)
-
-    # Creating analogy-driven text
-    p_a_llm.extract_concepts()
-    p_a_llm.create_analogies()
+    return {"A": p_a_llm, "B": p_b_llm, "J": j_llm}, [Stage("no_recomp", run, inputs=[], outputs=[])]
 
-    # Personalize first-pass
-    p_b_llm.personalize()
-    p_b_llm.extract_sections()
-    p_b_llm.insert_analogies(p_a_llm)
 
-    # LLM-as-a-Judge with simulation (student & expert)
-    j_llm.give_feedback_student(p_b_llm)
-    j_llm.give_feedback_expert(p_b_llm)
-
-    # Improve based on feedback
-    p_b_llm.refine_student()
-    p_b_llm.refine_expert()
-    p_b_llm.finalize()
-
-def no_analogy(reference_text:str, user_interest:str, save_dir:str):
+def complete(reference_text:str, user_interest:str, save_dir:str, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None):
     # Initialize LLMs
-    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir)
-    j_llm = pipeline.Judge(user_interest, reference_text, save_dir)
+    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir, analogy_store=analogy_store)
+    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir, workers=section_workers, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+    j_llm = pipeline.Judge(user_interest, reference_text, save_dir, chunk_tokens=chunk_tokens, workers=section_workers)
+
+    return {"A": p_a_llm, "B": p_b_llm, "J": j_llm}, [
+        # Creating analogy-driven text
+        Stage("A.extract_concepts", p_a_llm.extract_concepts, inputs=["A.reference_text"], outputs=["A.concepts"]),
+        Stage("A.create_analogies", p_a_llm.create_analogies, inputs=["A.concepts", "A.user_interest"], outputs=["A.draft_dict", "A.draft_chunks", "A.draft"]),
+
+        # Personalize first-pass
+        Stage("B.personalize", p_b_llm.personalize, inputs=["B.reference_text", "B.user_interest", "B.chunk_tokens"], outputs=["B.draft"]),
+        Stage("B.extract_sections", p_b_llm.extract_sections, inputs=["B.draft", "B.sectioner", "B.chunk_tokens"], outputs=["B.sections"]),
+        Stage("B.insert_analogies", p_b_llm.insert_analogies, p_a_llm, inputs=["B.sections", "A.draft_dict"], outputs=["B.draft_analogy", "B.draft", "B.unmatched_concepts"]),
+
+        # LLM-as-a-Judge with simulation (student & expert)
+        Stage("J.give_feedback_student", j_llm.give_feedback_student, p_b_llm, inputs=["B.draft"], outputs=["B.feedback_student"]),
+        Stage("J.give_feedback_expert", j_llm.give_feedback_expert, p_b_llm, inputs=["B.draft"], outputs=["B.feedback_expert"]),
+
+        # Improve based on feedback
+        Stage("B.refine_student", p_b_llm.refine_student, inputs=["B.sections", "B.feedback_student"], outputs=["B.draft"]),
+        Stage("B.refine_expert", p_b_llm.refine_expert, inputs=["B.sections", "B.feedback_expert"], outputs=["B.draft"]),
+        Stage("B.finalize", p_b_llm.finalize, inputs=["B.draft"], outputs=["B.final_draft"]),
+    ]
+
+def no_analogy(reference_text:str, user_interest:str, save_dir:str, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None):
+    # Initialize LLMs
+    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir, workers=section_workers, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+    j_llm = pipeline.Judge(user_interest, reference_text, save_dir, chunk_tokens=chunk_tokens, workers=section_workers)
 
-    # Personalize first-pass
-    p_b_llm.personalize()
-    p_b_llm.extract_sections()
+    return {"B": p_b_llm, "J": j_llm}, [
+        # Personalize first-pass
+        Stage("B.personalize", p_b_llm.personalize, inputs=["B.reference_text", "B.user_interest", "B.chunk_tokens"], outputs=["B.draft"]),
+        Stage("B.extract_sections", p_b_llm.extract_sections, inputs=["B.draft", "B.sectioner", "B.chunk_tokens"], outputs=["B.sections"]),
 
-    # LLM-as-a-Judge with simulation (student & expert)
-    j_llm.give_feedback_student(p_b_llm)
-    j_llm.give_feedback_expert(p_b_llm)
+        # LLM-as-a-Judge with simulation (student & expert)
+        Stage("J.give_feedback_student", j_llm.give_feedback_student, p_b_llm, inputs=["B.draft"], outputs=["B.feedback_student"]),
+        Stage("J.give_feedback_expert", j_llm.give_feedback_expert, p_b_llm, inputs=["B.draft"], outputs=["B.feedback_expert"]),
 
-    # Improve based on feedback
-    p_b_llm.refine_student()
-    p_b_llm.refine_expert()
-    p_b_llm.finalize()
+        # Improve based on feedback
+        Stage("B.refine_student", p_b_llm.refine_student, inputs=["B.sections", "B.feedback_student"], outputs=["B.draft"]),
+        Stage("B.refine_expert", p_b_llm.refine_expert, inputs=["B.sections", "B.feedback_expert"], outputs=["B.draft"]),
+        Stage("B.finalize", p_b_llm.finalize, inputs=["B.draft"], outputs=["B.final_draft"]),
+    ]
 
-def no_feedback(reference_text:str, user_interest:str, save_dir:str):
-        # Initialize LLMs
-    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir)
-    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir)
-    j_llm = pipeline.Judge(user_interest, reference_text, save_dir)
+def no_feedback(reference_text:str, user_interest:str, save_dir:str, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None):
+    # Initialize LLMs
+    p_a_llm = pipeline.PC("A", user_interest, reference_text, save_dir, analogy_store=analogy_store)
+    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir, workers=section_workers, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
 
-    # Creating analogy-driven text
-    p_a_llm.extract_concepts()
-    p_a_llm.create_analogies()
+    return {"A": p_a_llm, "B": p_b_llm}, [
+        # Creating analogy-driven text
+        Stage("A.extract_concepts", p_a_llm.extract_concepts, inputs=["A.reference_text"], outputs=["A.concepts"]),
+        Stage("A.create_analogies", p_a_llm.create_analogies, inputs=["A.concepts", "A.user_interest"], outputs=["A.draft_dict", "A.draft_chunks", "A.draft"]),
 
-    # Personalize first-pass
-    p_b_llm.personalize()
-    p_b_llm.extract_sections()
-    p_b_llm.insert_analogies(p_a_llm)
+        # Personalize first-pass
+        Stage("B.personalize", p_b_llm.personalize, inputs=["B.reference_text", "B.user_interest", "B.chunk_tokens"], outputs=["B.draft"]),
+        Stage("B.extract_sections", p_b_llm.extract_sections, inputs=["B.draft", "B.sectioner", "B.chunk_tokens"], outputs=["B.sections"]),
+        Stage("B.insert_analogies", p_b_llm.insert_analogies, p_a_llm, inputs=["B.sections", "A.draft_dict"], outputs=["B.draft_analogy", "B.draft", "B.unmatched_concepts"]),
 
-    p_b_llm.finalize()
+        Stage("B.finalize", p_b_llm.finalize, inputs=["B.draft"], outputs=["B.final_draft"]),
+    ]
 
 STRATEGIES = {
     "complete": complete, # all components included
@@ -111,7 +133,34 @@ STRATEGIES = {
     "no_feedback": no_feedback, # all components included except Feedback
 }
 
-def main(og_chapter_src:str, user_interest:str, strategy_name:str):
+def get_chapter_dir(og_chapter_src:str) -> str:
+    # Nested sub-chapter files keep their folder so sibling files never share a save_dir
+    chapter_path = Path(og_chapter_src).with_suffix("")
+    course_name = chapter_path.parts[1]
+    chapter_title = "/".join("-".join(part.split(".")) for part in chapter_path.parts[2:])
+    return f"output/{course_name}/{chapter_title}"
+
+
+def get_save_dir(og_chapter_src:str, user_interest:str) -> str:
+    curr_date = datetime.now()
+    timestamp_str = curr_date.strftime("%Y-%m-%d_%H-%M-%S")
+    return f"{get_chapter_dir(og_chapter_src)}/{timestamp_str}_{user_interest}"
+
+
+def get_last_run(og_chapter_src:str, user_interest:str, strategy_name:str) -> str:
+    """Newest earlier save_dir of the same (chapter, interest, strategy) that recorded its sections, if any."""
+    chapter_dir = Path(get_chapter_dir(og_chapter_src))
+    if not chapter_dir.exists():
+        return None
+
+    job = {"chapter": og_chapter_src, "interest": user_interest, "strategy": strategy_name}
+    for run_dir in sorted(chapter_dir.iterdir(), reverse=True):
+        if get_artifact_store().read(run_dir, "sections.json") is not None and Checkpoint.load(run_dir)["job"] == job:
+            return str(run_dir)
+    return None
+
+
+def main(og_chapter_src:str, user_interest:str, strategy_name:str, save_dir:str=None, section_workers:int=8, analogy_store=None, resume:bool=False, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None, stage_workers:int=4) -> str:
     # Get relevant strategy function
     strategy = STRATEGIES[strategy_name]
 
@@ -119,28 +168,215 @@ def main(og_chapter_src:str, user_interest:str, strategy_name:str):
     reference_text = read(og_chapter_src)
 
     # Setting logistics
-    course_name, chapter_title = og_chapter_src.split("/")[1:3]
-    chapter_title = "-".join(chapter_title.split(".")[:-1])
-    curr_date = datetime.now()
-    timestamp_str = curr_date.strftime("%Y-%m-%d_%H-%M-%S")
-    save_dir = f"output/{course_name}/{chapter_title}/{timestamp_str}_{user_interest}"
+    if save_dir is None:
+        save_dir = get_save_dir(og_chapter_src, user_interest)
 
     # Document execution strategy
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
-    with open(f"{save_dir}/strategy.txt", "w", encoding="utf-8") as file:
-        file.write(f"Strategy: {strategy_name}")
-        logger.info(f"Strategy logged in {save_dir}/strategy.txt")
-
-    strategy(reference_text, user_interest, save_dir)
+    get_artifact_store().write(save_dir, "strategy.txt", f"Strategy: {strategy_name}")
+    logger.info(f"Strategy logged in {save_dir}/strategy.txt")
+    Checkpoint.save_job(save_dir, {"chapter": og_chapter_src, "interest": user_interest, "strategy": strategy_name})
+
+    # Record every model call of this run for the usage report
+    recorder = UsageRecorder(chapter=og_chapter_src, interest=user_interest, strategy=strategy_name)
+    token = llm.set_recorder(recorder)
+    try:
+        run_strategy(strategy, reference_text, user_interest, save_dir, resume=resume, section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens, stage_workers=stage_workers)
+    finally:
+        llm.reset_recorder(token)
+        recorder.write_report(save_dir)
+        get_artifact_store().flush(save_dir)
     logger.success(f"Personalization completed! All work is saved in {save_dir}")
+    return save_dir
+
+
+def run_strategy(strategy, reference_text:str, user_interest:str, save_dir:str, resume:bool=False, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None, stage_workers:int=4) -> dict:
+    objects, stages = strategy(reference_text, user_interest, save_dir, section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+    # Independent stages (e.g. the analogy chain and personalize) run concurrently
+    Scheduler(Checkpoint(save_dir, objects, resume=resume), save_dir, workers=stage_workers).run(stages)
+    return objects
+
+
+def incremental(og_chapter_src:str, user_interest:str, strategy_name:str, save_dir:str=None, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None, stage_workers:int=4) -> str:
+    """Personalize the chapter section by section, reusing every section unchanged since the last incremental run."""
+    strategy = STRATEGIES[strategy_name]
+    reference_text = read(og_chapter_src)
+    sections = split_sections(reference_text)
+    hashes = [hashlib.sha256(section.encode("utf-8")).hexdigest() for section in sections]
+
+    previous = get_last_run(og_chapter_src, user_interest, strategy_name)
+    reusable = {}
+    if previous is not None:
+        reusable = {entry["hash"]: entry for entry in json.loads(get_artifact_store().read(previous, "sections.json"))}
+    changed = [i for i, section_hash in enumerate(hashes) if section_hash not in reusable]
+    logger.info(f"{len(changed)}/{len(sections)} reference sections changed since {previous or 'no earlier incremental run'}")
+
+    if save_dir is None:
+        save_dir = get_save_dir(og_chapter_src, user_interest)
+    get_artifact_store().write(save_dir, "strategy.txt", f"Strategy: {strategy_name}")
+    logger.info(f"Strategy logged in {save_dir}/strategy.txt")
+    Checkpoint.save_job(save_dir, {"chapter": og_chapter_src, "interest": user_interest, "strategy": strategy_name})
+
+    # With nothing to reuse, one whole-chapter run (with the chapter's full context) seeds every section at the cost of a plain run;
+    # otherwise each changed section runs the full strategy on its own as if it were a chapter
+    seeding = len(changed) == len(sections)
+
+    def run_section(i:int) -> str:
+        objects = run_strategy(strategy, sections[i], user_interest, f"{save_dir}/sections/{i:03d}", section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens, stage_workers=stage_workers)
+        return objects["B"].final_draft
+
+    recorder = UsageRecorder(chapter=og_chapter_src, interest=user_interest, strategy=strategy_name)
+    token = llm.set_recorder(recorder)
+    try:
+        if seeding:
+            objects = run_strategy(strategy, reference_text, user_interest, save_dir, section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens, stage_workers=stage_workers)
+            finals = dict(enumerate(regroup(split_sections(objects["B"].final_draft), sections)))
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(section_workers, len(changed)))) as executor:
+                finals = dict(zip(changed, executor.map(lambda i: copy_context().run(run_section, i), changed)))
+    finally:
+        llm.reset_recorder(token)
+        recorder.write_report(save_dir)
+
+    entries = []
+    for i, section_hash in enumerate(hashes):
+        if i in finals:
+            entries.append({"hash": section_hash, "final": finals[i], "source": save_dir if seeding else f"{save_dir}/sections/{i:03d}"})
+        else:
+            entries.append(reusable[section_hash])
+
+    get_artifact_store().write(save_dir, "sections.json", json.dumps(entries, indent=2))
+    logger.info(f"Section hashes and personalized sections saved in {save_dir}/sections.json")
+
+    # Splice reused and regenerated sections back into one chapter; a section left empty (e.g. no concept matched it
+    # in insert_analogies) is a valid result and keeps its reference text, so the chapter never loses a section
+    p_b_llm = pipeline.PS("B", user_interest, reference_text, save_dir)
+    p_b_llm.draft = "".join(f"{(entry['final'] if entry['final'].strip() else section).strip()}\n\n" for entry, section in zip(entries, sections))
+    p_b_llm.finalize()
+    get_artifact_store().flush(save_dir)
+
+    logger.success(f"Incremental personalization completed ({len(changed)} of {len(sections)} sections regenerated)! All work is saved in {save_dir}")
+    return save_dir
+
+
+def prefill_packed(sources:list, user_interests:list, strategy_name:str, packer, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None) -> tuple:
+    """Run the whole-chapter stages of small sibling chapters as packed requests and checkpoint the results into each chapter's save_dir."""
+    strategy = STRATEGIES[strategy_name]
+    jobs = []
+    for src in sources:
+        reference_text = read(src)
+        for user_interest in user_interests:
+            save_dir = get_save_dir(src, user_interest)
+            objects, stages = strategy(reference_text, user_interest, save_dir, section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+            jobs.append((src, user_interest, save_dir, objects, {stage.name: stage for stage in stages}))
+
+    report_dir = f"{jobs[0][2]}/pack"
+    recorder = UsageRecorder(chapter=", ".join(sources), interest=", ".join(user_interests), strategy=strategy_name)
+    token = llm.set_recorder(recorder)
+    try:
+        drafts = {}
+        concepts = {}
+        if all("B.personalize" in stages for _, _, _, _, stages in jobs):
+            for user_interest in user_interests:
+                packed = packer.personalize([objects["B"].reference_text for _, interest, _, objects, _ in jobs if interest == user_interest], user_interest)
+                drafts.update({(src, user_interest): draft for src, draft in zip(sources, packed)})
+        if all("A.extract_concepts" in stages for _, _, _, _, stages in jobs):
+            # Concepts come from the reference alone, so one packed request serves every interest
+            concepts = dict(zip(sources, packer.extract_concepts([read(src) for src in sources])))
+    finally:
+        llm.reset_recorder(token)
+        recorder.write_report(report_dir)
+
+    for src, user_interest, save_dir, objects, stages in jobs:
+        ckpt = Checkpoint(save_dir, objects)
+        if drafts.get((src, user_interest)) is not None:
+            objects["B"].draft = drafts[(src, user_interest)]
+            objects["B"]._save_draft()
+            ckpt.record("B.personalize", stages["B.personalize"].inputs, stages["B.personalize"].outputs)
+        if concepts.get(src) is not None:
+            objects["A"].concepts = concepts[src]
+            objects["A"]._save_specs()
+            ckpt.record("A.extract_concepts", stages["A.extract_concepts"].inputs, stages["A.extract_concepts"].outputs)
+
+    # main(src, ..., save_dir, resume=True) then skips the prefilled stages
+    return {(src, user_interest): save_dir for src, user_interest, save_dir, _, _ in jobs}, report_dir
+
+
+def prefill_shared(og_chapter_src:str, user_interests:list, strategy_name:str, section_workers:int=8, analogy_store=None, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None) -> tuple:
+    """Run the interest-independent stages of a chapter once and checkpoint their outputs into every interest's save_dir."""
+    strategy = STRATEGIES[strategy_name]
+    reference_text = read(og_chapter_src)
+    jobs = []
+    for user_interest in user_interests:
+        save_dir = get_save_dir(og_chapter_src, user_interest)
+        objects, stages = strategy(reference_text, user_interest, save_dir, section_workers=section_workers, analogy_store=analogy_store, sectioner=sectioner, stream=stream, chunk_tokens=chunk_tokens)
+        jobs.append((user_interest, save_dir, objects, {stage.name: stage for stage in stages}))
+
+    # Strategies without a concept stage (or with one opaque stage) have nothing to share
+    if "A.extract_concepts" not in jobs[0][3]:
+        return {}, None
+
+    # The first interest's objects do the work; the rest copy its outputs
+    _, first_dir, first_objects, first_stages = jobs[0]
+    stage = first_stages["A.extract_concepts"]
+    report_dir = f"{first_dir}/shared"
+    recorder = UsageRecorder(chapter=og_chapter_src, interest=", ".join(user_interests), strategy=strategy_name)
+    token = llm.set_recorder(recorder)
+    try:
+        Checkpoint(first_dir, first_objects).run(stage.name, stage.fn, *stage.args, inputs=stage.inputs, outputs=stage.outputs)
+    finally:
+        llm.reset_recorder(token)
+        recorder.write_report(report_dir)
+
+    for _, save_dir, objects, stages in jobs[1:]:
+        objects["A"].concepts = first_objects["A"].concepts
+        objects["A"]._save_specs()
+        Checkpoint(save_dir, objects).record(stage.name, stage.inputs, stage.outputs)
+
+    # main(og_chapter_src, ..., save_dir, resume=True) then skips the shared stages
+    return {user_interest: save_dir for user_interest, save_dir, _, _ in jobs}, report_dir
 
 
 if __name__ == "__main__":
     load_dotenv()
     parser = ArgumentParser()
-    parser.add_argument("-c", "--chapter", dest="chapter", help="The original textbook chapter to personalize", required=True)
-    parser.add_argument("-i", "--interest", dest="interest", help="Your personal/professional interest", required=True)
-    parser.add_argument("-s", "--strategy", dest="strategy", help="Execution strategy", required=True, choices=list(STRATEGIES.keys()))
+    parser.add_argument("-c", "--chapter", dest="chapter", help="The original textbook chapter to personalize")
+    parser.add_argument("-i", "--interest", dest="interest", help="Your personal/professional interest")
+    parser.add_argument("-s", "--strategy", dest="strategy", help="Execution strategy", choices=list(STRATEGIES.keys()))
+    parser.add_argument("--resume", dest="resume", help="Resume an earlier run in this save_dir, skipping its completed stages", default=None)
+    parser.add_argument("--incremental", dest="incremental", help="Only re-personalize reference sections changed since the last incremental run of this chapter, interest and strategy", action="store_true")
+    parser.add_argument("-w", "--section-workers", dest="section_workers", help="Number of sections refined concurrently", type=int, default=8)
+    parser.add_argument("--stage-workers", dest="stage_workers", help="Number of independent stages run concurrently", type=int, default=4)
+    parser.add_argument("--sectioner", dest="sectioner", help="How drafts are split into sections", default="llm", choices=["llm", "markdown"])
+    parser.add_argument("--stream", dest="stream", help="Stream the personalized chapter into draft.md as it is generated", action="store_true")
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", help="Personalize and judge chapters over this many tokens chunk by chunk (map-reduce)", type=int, default=None)
+    parser.add_argument("--analogy-store", dest="analogy_store", help="JSONL file of analogies reused across chapters and runs", default=None)
+    parser.add_argument("--trace", dest="trace", help="Write a Chrome trace / Perfetto JSON of every stage, method, model call and save to this file", default=None)
+    add_runtime_args(parser)
     args = parser.parse_args()
 
-    main(args.chapter, args.interest, args.strategy)
+    if args.resume:
+        job = Checkpoint.load(args.resume)["job"]
+        args.chapter = args.chapter or job.get("chapter")
+        args.interest = args.interest or job.get("interest")
+        args.strategy = args.strategy or job.get("strategy")
+    if not (args.chapter and args.interest and args.strategy):
+        parser.error("-c/--chapter, -i/--interest and -s/--strategy are required unless --resume points at an earlier run")
+    if args.incremental and args.resume:
+        parser.error("--incremental cannot be combined with --resume")
+
+    configure(args)
+    analogy_store = AnalogyStore(args.analogy_store) if args.analogy_store else None
+    tracer = Tracer() if args.trace else None
+    set_tracer(tracer)
+    try:
+        if args.incremental:
+            incremental(args.chapter, args.interest, args.strategy, section_workers=args.section_workers, analogy_store=analogy_store, sectioner=args.sectioner, stream=args.stream, chunk_tokens=args.chunk_tokens, stage_workers=args.stage_workers)
+        else:
+            main(args.chapter, args.interest, args.strategy, save_dir=args.resume, section_workers=args.section_workers, analogy_store=analogy_store, resume=bool(args.resume), sectioner=args.sectioner, stream=args.stream, chunk_tokens=args.chunk_tokens, stage_workers=args.stage_workers)
+    finally:
+        if tracer is not None:
+            tracer.export(args.trace)
+
+    if analogy_store is not None:
+        logger.info(f"Analogy store stats: {analogy_store.stats()}")
+    log_stats()
@@ -1,12 +1,173 @@
-from gen import main
+import asyncio
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+from loguru import logger
 from pathlib import Path
 from tqdm import tqdm
 
+from gen import STRATEGIES, get_save_dir, main, prefill_packed, prefill_shared
+from pipeline import client, llm
+from pipeline.AnalogyStore import AnalogyStore
+from pipeline.BatchRunner import BatchRunner
+from pipeline.Packer import Packer
+from pipeline.Usage import aggregate
+from pipeline.runtime import add_runtime_args, configure, log_stats
+from pipeline.trace import Tracer, set_tracer
+
+
+INTERESTS = ["astrophysics", "chemistry", "history"]
+
+
+class Progress():
+    def __init__(self, total:int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.running = 0
+        self.save_dirs = []
+        self.start = time.monotonic()
+        self.bar = tqdm(total=total, desc="total markdown files")
+
+
+    def jobs_per_minute(self) -> float:
+        elapsed = time.monotonic() - self.start
+        return 60 * (self.done + self.failed) / elapsed if elapsed > 0 else 0.0
+
+
+    def update(self) -> None:
+        self.bar.set_postfix(jobs_per_min=f"{self.jobs_per_minute():.2f}", jobs_running=self.running, requests_in_flight=llm.in_flight(), failed=self.failed)
+
+
+async def run_job(src:str, interest:str, strategy_name:str, options:dict, semaphore:asyncio.Semaphore, progress:Progress, save_dir:str=None) -> None:
+    async with semaphore:
+        # A save_dir handed in was prefilled by shared or packed requests, so resume past its completed stages
+        resume = save_dir is not None
+        save_dir = save_dir or get_save_dir(src, interest)
+        Path(save_dir).mkdir(parents=True, exist_ok=True)
+        progress.save_dirs.append(save_dir)
+
+        # Route this job's log lines (including the worker thread's) into its own save_dir
+        sink = logger.add(f"{save_dir}/run.log", filter=lambda record: record["extra"].get("job") == save_dir)
+        progress.running += 1
+        progress.update()
+
+        try:
+            with logger.contextualize(job=save_dir):
+                await asyncio.to_thread(main, src, interest, strategy_name, save_dir, resume=resume, **options)
+            progress.done += 1
+        except Exception:
+            logger.exception(f"Job {src} ({interest}) failed; see {save_dir}/run.log")
+            progress.failed += 1
+        finally:
+            logger.remove(sink)
+            progress.running -= 1
+            progress.bar.update(1)
+            progress.update()
+
+
+async def run_chapter(src:str, interests:list, strategy_name:str, options:dict, semaphore:asyncio.Semaphore, progress:Progress, save_dirs:dict=None) -> None:
+    save_dirs = save_dirs or {}
+    if not save_dirs and len(interests) > 1:
+        # Interest-independent stages run once for the chapter instead of once per interest
+        async with semaphore:
+            try:
+                save_dirs, report_dir = await asyncio.to_thread(prefill_shared, src, interests, strategy_name, **{key: value for key, value in options.items() if key != "stage_workers"})
+                if report_dir is not None:
+                    progress.save_dirs.append(report_dir)
+            except Exception:
+                logger.exception(f"Shared stages of {src} failed; running each interest from scratch")
+
+    await asyncio.gather(*[run_job(src, interest, strategy_name, options, semaphore, progress, save_dir=save_dirs.get(interest)) for interest in interests])
+
+
+async def run_pack(pack:list, interests:list, strategy_name:str, options:dict, packer, semaphore:asyncio.Semaphore, progress:Progress) -> None:
+    save_dirs = {}
+    if len(pack) > 1:
+        async with semaphore:
+            try:
+                save_dirs, report_dir = await asyncio.to_thread(prefill_packed, pack, interests, strategy_name, packer, **{key: value for key, value in options.items() if key != "stage_workers"})
+                progress.save_dirs.append(report_dir)
+            except Exception:
+                logger.exception(f"Packed request for {len(pack)} files failed; running them unpacked")
+
+    await asyncio.gather(*[run_chapter(src, interests, strategy_name, options, semaphore, progress, save_dirs={interest: save_dirs[(src, interest)] for interest in interests if (src, interest) in save_dirs}) for src in pack])
+
+
+async def report(progress:Progress, interval:float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        progress.update()
+        logger.info(f"Throughput: {progress.jobs_per_minute():.2f} jobs/min, {progress.running} jobs running, {llm.in_flight()} requests in flight ({progress.done + progress.failed}/{progress.total} done), connection pool: {client.pool_stats()}, limiter: {llm.get_limiter().stats() if llm.get_limiter() else None}")
+
+
+async def run_all(files:list, interests:list, strategy_name:str, concurrency:int, options:dict, interval:float, packer=None) -> Progress:
+    # Every admitted job holds a worker thread, so size the default executor to the job limit
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = Progress(len(files) * len(interests))
+    reporter = asyncio.create_task(report(progress, interval))
+
+    try:
+        if packer is not None:
+            packs = packer.pack(files)
+            await asyncio.gather(*[run_pack(pack, interests, strategy_name, options, packer, semaphore, progress) for pack in packs])
+        else:
+            await asyncio.gather(*[run_chapter(str(file), interests, strategy_name, options, semaphore, progress) for file in files])
+    finally:
+        reporter.cancel()
+        progress.bar.close()
+
+    return progress
+
+
 # DFS go through every file in og-textbooks/berkeley-cs61b, and find all .md files
 if __name__ == "__main__":
-    INTERESTS = ["astrophysics", "chemistry", "history"]
+    load_dotenv()
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--strategy", dest="strategy", help="Execution strategy", default="complete", choices=list(STRATEGIES.keys()))
+    parser.add_argument("-n", "--concurrency", dest="concurrency", help="Maximum number of chapter jobs running at once", type=int, default=8)
+    parser.add_argument("-w", "--section-workers", dest="section_workers", help="Number of sections refined concurrently within each job", type=int, default=8)
+    parser.add_argument("--stage-workers", dest="stage_workers", help="Number of independent stages run concurrently within each job", type=int, default=4)
+    parser.add_argument("--sectioner", dest="sectioner", help="How drafts are split into sections", default="llm", choices=["llm", "markdown"])
+    parser.add_argument("--batch", dest="batch", help="Send each stage's requests for all chapters as one batch (openai: Batch API, local: replay against OPENAI_BASE_URL)", default=None, choices=["openai", "local"])
+    parser.add_argument("--batch-quiet", dest="batch_quiet", help="Seconds without new requests before a batch is submitted", type=float, default=5)
+    parser.add_argument("--report-dir", dest="report_dir", help="Where the aggregated usage report of all jobs is written", default="output")
+    parser.add_argument("--stream", dest="stream", help="Stream the personalized chapter into draft.md as it is generated", action="store_true")
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", help="Personalize and judge chapters over this many tokens chunk by chunk (map-reduce)", type=int, default=None)
+    parser.add_argument("--report-interval", dest="report_interval", help="Seconds between throughput reports", type=float, default=30)
+    parser.add_argument("--analogy-store", dest="analogy_store", help="JSONL file of analogies reused across chapters and runs", default=None)
+    parser.add_argument("--pack-budget", dest="pack_budget", help="Pack sibling files up to this many tokens into one request for the whole-chapter stages", type=int, default=None)
+    parser.add_argument("--trace", dest="trace", help="Write a Chrome trace / Perfetto JSON of every stage, method, model call and save to this file", default=None)
+    add_runtime_args(parser)
+    args = parser.parse_args()
+
+    configure(args)
+
+    analogy_store = AnalogyStore(args.analogy_store) if args.analogy_store else None
+    options = {"section_workers": args.section_workers, "analogy_store": analogy_store, "sectioner": args.sectioner, "stream": args.stream, "chunk_tokens": args.chunk_tokens, "stage_workers": args.stage_workers}
+
     files = list(Path("og-textbooks/berkeley-cs61b").rglob("*.md"))
-    for interest in INTERESTS:
-        for file in tqdm(files, desc="total markdown files"):
-            print(file)
-            main(str(file), interest, "complete")
+    concurrency = args.concurrency
+    if args.batch:
+        # All jobs must be live at once so each stage's requests land in the same batch
+        concurrency = len(files) * len(INTERESTS)
+        work_dir = f"output/batches/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        llm.set_batch(BatchRunner(client.get_client(), work_dir, backend=args.batch, quiet=args.batch_quiet))
+
+    packer = Packer(budget=args.pack_budget) if args.pack_budget else None
+    tracer = Tracer() if args.trace else None
+    set_tracer(tracer)
+    try:
+        progress = asyncio.run(run_all(files, INTERESTS, args.strategy, concurrency, options, args.report_interval, packer=packer))
+    finally:
+        if tracer is not None:
+            tracer.export(args.trace)
+    aggregate(progress.save_dirs, args.report_dir)
+    logger.success(f"Finished {progress.done}/{progress.total} jobs ({progress.failed} failed) at {progress.jobs_per_minute():.2f} jobs/min")
+    if analogy_store is not None:
+        logger.info(f"Analogy store stats: {analogy_store.stats()}")
+    log_stats()
@@ -0,0 +1,109 @@
+import json
+import os
+
+from loguru import logger
+from pathlib import Path
+from threading import Event, Lock
+
+from pipeline.ConceptIndex import tokenize
+
+
+class AnalogyStore():
+    def __init__(self, path:str):
+        self.path = Path(path)
+        self.lock = Lock()
+        self.analogies = {}
+        self.pending = {}
+        self.torn = False
+
+        self.hits = 0
+        self.misses = 0
+
+        # Append-only JSONL: later lines win, so concurrent writers never clobber each other
+        if self.path.exists():
+            line = ""
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a writer killed mid-append (e.g. a sweep job that lost its lease)
+                        logger.warning(f"Skipped a truncated analogy in {self.path}")
+                        continue
+                    self.analogies[entry["key"]] = entry["text"]
+                # Start the next entry on a line of its own rather than after a truncated tail
+                self.torn = not line.endswith("\n") if line else False
+            logger.info(f"Loaded {len(self.analogies)} analogies from {self.path}")
+
+
+    @staticmethod
+    def normalize(concept:str, user_interest:str) -> str:
+        # Same tokens as section matching, so "Linked Lists" and "linked list" share an entry
+        concept = " ".join(tokenize(concept))
+        user_interest = " ".join(user_interest.lower().split())
+
+        return f"{concept}::{user_interest}"
+
+
+    def get_or_create(self, concept:str, user_interest:str, create) -> str:
+        key = self.normalize(concept, user_interest)
+
+        with self.lock:
+            if key in self.analogies:
+                self.hits += 1
+                return self.analogies[key]
+
+            event = self.pending.get(key)
+            owner = event is None
+            if owner:
+                event = self.pending[key] = Event()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        # Only the first caller for a key generates it; the rest wait for its result
+        if not owner:
+            event.wait()
+            with self.lock:
+                if key in self.analogies:
+                    return self.analogies[key]
+            return self.get_or_create(concept, user_interest, create)
+
+        try:
+            text = create(concept)
+            with self.lock:
+                self.analogies[key] = text
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._append(json.dumps({"key": key, "concept": concept, "interest": user_interest, "text": text}) + "\n")
+            return text
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+
+    def _append(self, line:str) -> None:
+        # One write under O_APPEND per entry, so a killed writer can only truncate the tail
+        data = (("\n" if self.torn else "") + line).encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self.torn = False
+
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.analogies),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    pass
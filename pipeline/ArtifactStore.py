@@ -0,0 +1,193 @@
+import atexit
+import json
+import os
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime
+from loguru import logger
+from pathlib import Path
+from threading import Lock
+
+from pipeline.trace import span
+
+
+FILENAME = "artifacts.jsonl"
+
+
+class FileStore():
+    """One file per artifact under the run's save_dir (the original layout)."""
+
+    def write(self, save_dir:str, name:str, text:str) -> None:
+        path = Path(save_dir) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Replaced whole, so a crash never leaves a half-written manifest or draft behind;
+        # every writer gets its own temp file, so two workers writing one artifact never share one
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as file:
+                tmp_path = file.name
+                file.write(text)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+
+    def read(self, save_dir:str, name:str) -> str:
+        return _read(save_dir, name)
+
+
+    def flush(self, save_dir:str=None) -> None:
+        pass
+
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlStore():
+    """One append-only artifacts.jsonl per run; writes are buffered and appended in batches, when a run ends or every interval seconds."""
+
+    def __init__(self, batch_size:int=64, interval:float=30.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = Lock()
+        self.buffers = {}
+        self.started = {}
+        self.flushes = 0
+        self.records = 0
+        atexit.register(self.close)
+
+
+    def write(self, save_dir:str, name:str, text:str) -> None:
+        with self.lock:
+            run_dir = str(save_dir)
+            buffer = self.buffers.setdefault(run_dir, {})
+            self.started.setdefault(run_dir, time.monotonic())
+            # Rewrites within one batch (e.g. the manifest after every stage) only keep their latest text
+            buffer.pop(name, None)
+            buffer[name] = {"name": name, "text": text, "saved_at": datetime.now().isoformat()}
+            due = len(buffer) >= self.batch_size or time.monotonic() - self.started[run_dir] >= self.interval
+        if due:
+            self.flush(save_dir)
+
+
+    def read(self, save_dir:str, name:str) -> str:
+        with self.lock:
+            record = self.buffers.get(str(save_dir), {}).get(name)
+        return record["text"] if record is not None else _read(save_dir, name)
+
+
+    def flush(self, save_dir:str=None) -> None:
+        """Append the buffered artifacts of one run (or of every run) to its artifacts.jsonl."""
+        with self.lock:
+            dirs = [str(save_dir)] if save_dir is not None else list(self.buffers)
+            for run_dir in dirs:
+                buffer = list(self.buffers.pop(run_dir, {}).values())
+                self.started.pop(run_dir, None)
+                if not buffer:
+                    continue
+                with span("JsonlStore.flush", "save", save_dir=run_dir, artifacts=len(buffer)):
+                    Path(run_dir).mkdir(parents=True, exist_ok=True)
+                    with open(Path(run_dir) / FILENAME, "a", encoding="utf-8") as file:
+                        file.write("".join(json.dumps(record) + "\n" for record in buffer))
+                self.flushes += 1
+                self.records += len(buffer)
+
+
+    def close(self) -> None:
+        self.flush()
+
+
+    def stats(self) -> dict:
+        return {"flushes": self.flushes, "artifacts": self.records}
+
+
+_store = FileStore()
+
+
+def set_artifact_store(store) -> None:
+    global _store
+    _store = store
+
+
+def get_artifact_store():
+    return _store
+
+
+def load(save_dir:str) -> dict:
+    """Latest text of every artifact a run stored in its artifacts.jsonl, keyed by its path relative to save_dir."""
+    path = Path(save_dir) / FILENAME
+    artifacts = {}
+    if path.exists():
+        # Append-only: later lines win, like rewriting the file did
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash mid-append; every manifest before it only covers artifacts written ahead of it
+                    logger.warning(f"Skipped a truncated record in {path}")
+                    continue
+                artifacts[record["name"]] = record["text"]
+    return artifacts
+
+
+def runs(root:str):
+    """Yield (run_dir, artifacts) for every run under root that has an artifact store."""
+    for path in sorted(Path(root).rglob(FILENAME)):
+        yield path.parent, load(path.parent)
+
+
+def read_artifact(path:str) -> str:
+    """Read an artifact from its file if it was written or exported, otherwise from the artifact store of the run containing it."""
+    path = Path(path)
+    if path.exists():
+        return path.read_text(encoding="utf-8").strip()
+
+    for run_dir in path.parents:
+        if (run_dir / FILENAME).exists():
+            artifacts = load(run_dir)
+            name = path.relative_to(run_dir).as_posix()
+            if name in artifacts:
+                return artifacts[name].strip()
+            break
+    raise FileNotFoundError(f"No file or stored artifact at {path}")
+
+
+def _read(save_dir:str, name:str) -> str:
+    # The file if there is one, else the run's artifacts.jsonl; None when the run has neither
+    path = Path(save_dir) / name
+    if path.exists():
+        return path.read_text(encoding="utf-8")
+    return load(save_dir).get(name) if (Path(save_dir) / FILENAME).exists() else None
+
+
+def export(save_dir:str, out_dir:str=None) -> int:
+    """Materialize a run's stored artifacts as the usual per-file layout; returns the number of files written."""
+    artifacts = load(save_dir)
+    store = FileStore()
+    for name, text in artifacts.items():
+        store.write(out_dir or save_dir, name, text)
+    return len(artifacts)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", help="export: write every stored artifact back out as files; list: show each run's stored artifacts", choices=["export", "list"])
+    parser.add_argument("roots", nargs="+", help="Run directories, or directories searched for runs")
+    parser.add_argument("--to", dest="to", help="With export, write into this directory (mirroring each run's path below its root) instead of into the runs themselves", default=None)
+    args = parser.parse_args()
+
+    for root in args.roots:
+        for run_dir, artifacts in runs(root):
+            if args.command == "list":
+                print(f"{run_dir}: {', '.join(sorted(artifacts))}")
+                continue
+            out_dir = Path(args.to) / run_dir.relative_to(root) if args.to else None
+            logger.info(f"Exported {export(run_dir, out_dir)} artifacts of {run_dir} to {out_dir or run_dir}")
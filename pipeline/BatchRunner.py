@@ -0,0 +1,159 @@
+import json
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger
+from openai.lib._parsing._completions import type_to_response_format_param
+from pathlib import Path
+from threading import Condition, Thread
+
+
+class BatchRunner():
+    """Collects completion requests from many concurrently running jobs and sends them as one batch.
+
+    Job threads block in submit() until their batch has been processed. Once no new request has
+    arrived for `quiet` seconds (i.e. every job is waiting on the same stage), the pending requests
+    are written to requests.jsonl and executed either through the OpenAI Batch API ("openai") or
+    one by one against the client's endpoint ("local", e.g. a stand-in server via OPENAI_BASE_URL).
+    """
+
+    MAX_REQUESTS = 50_000
+
+    def __init__(self, client, work_dir:str, backend:str="openai", quiet:float=5.0, poll_interval:float=30.0, local_workers:int=16):
+        self.client = client
+        self.work_dir = Path(work_dir)
+        self.backend = backend
+        self.quiet = quiet
+        self.poll_interval = poll_interval
+        self.local_workers = local_workers
+
+        self.condition = Condition()
+        self.pending = []
+        self.counter = 0
+        self.batches = 0
+        self.last_submit = 0.0
+
+        Thread(target=self._collect, daemon=True).start()
+
+
+    def submit(self, stage:str, kwargs:dict) -> dict:
+        body = {
+            "model": kwargs["model"],
+            "messages": kwargs["messages"],
+            "response_format": type_to_response_format_param(kwargs["response_format"]),
+        }
+        if kwargs.get("temperature") is not None:
+            body["temperature"] = kwargs["temperature"]
+
+        future = Future()
+        with self.condition:
+            self.counter += 1
+            self.pending.append((f"{self.counter}-{stage}", body, future))
+            self.last_submit = time.monotonic()
+            self.condition.notify()
+
+        return future.result()
+
+
+    def _collect(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Wait for the stage to go quiet so every job's request lands in the same batch
+                while (remaining := self.quiet - (time.monotonic() - self.last_submit)) > 0:
+                    self.condition.wait(timeout=remaining)
+                requests, self.pending = self.pending, []
+
+            for start in range(0, len(requests), self.MAX_REQUESTS):
+                chunk = requests[start:start + self.MAX_REQUESTS]
+                try:
+                    self._flush(chunk)
+                except Exception as e:
+                    for _, _, future in chunk:
+                        if not future.done():
+                            future.set_exception(e)
+
+
+    def _flush(self, requests:list) -> None:
+        self.batches += 1
+        batch_dir = self.work_dir / f"batch_{self.batches:04d}"
+        batch_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(batch_dir / "requests.jsonl", "w", encoding="utf-8") as file:
+            for custom_id, body, _ in requests:
+                file.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+        logger.info(f"Batch {self.batches}: {len(requests)} requests written to {batch_dir}/requests.jsonl")
+
+        if self.backend == "openai":
+            results = self._run_openai(batch_dir)
+        else:
+            results = self._run_local(requests)
+
+        with open(batch_dir / "results.jsonl", "w", encoding="utf-8") as file:
+            for result in results.values():
+                file.write(json.dumps(result) + "\n")
+
+        # Hand each result back to the job thread waiting on its custom_id
+        for custom_id, _, future in requests:
+            result = results.get(custom_id)
+            if result is None:
+                future.set_exception(RuntimeError(f"Batch {self.batches} returned no result for {custom_id}"))
+            elif result.get("error") or result["response"]["status_code"] != 200:
+                future.set_exception(RuntimeError(f"Batch request {custom_id} failed: {result.get('error') or result['response']['body']}"))
+            elif (error := self._unusable(result["response"]["body"])) is not None:
+                # Fail here, naming the line, rather than later on a missing parsed field in the caller
+                future.set_exception(RuntimeError(f"Batch request {custom_id} ({batch_dir}/results.jsonl) {error}"))
+            else:
+                future.set_result(result["response"]["body"])
+        logger.info(f"Batch {self.batches}: results saved in {batch_dir}/results.jsonl")
+
+
+    @staticmethod
+    def _unusable(body:dict) -> str:
+        # A refusal or an empty message has nothing to parse into the response format
+        choice = body["choices"][0]
+        message = choice["message"]
+        if message.get("refusal"):
+            return f"was refused: {message['refusal']}"
+        if not message.get("content"):
+            return f"returned no content (finish_reason: {choice.get('finish_reason')})"
+        return None
+
+
+    def _run_openai(self, batch_dir:Path) -> dict:
+        with open(batch_dir / "requests.jsonl", "rb") as file:
+            input_file = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        logger.info(f"Batch {self.batches} submitted as {batch.id}")
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            logger.info(f"Batch {batch.id}: {batch.status} ({batch.request_counts.completed}/{batch.request_counts.total} done)")
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        result = json.loads(line)
+                        results[result["custom_id"]] = result
+        return results
+
+
+    def _run_local(self, requests:list) -> dict:
+        def run(custom_id:str, body:dict) -> dict:
+            try:
+                completion = self.client.chat.completions.create(**body)
+                return {"custom_id": custom_id, "response": {"status_code": 200, "body": completion.model_dump()}, "error": None}
+            except Exception as e:
+                return {"custom_id": custom_id, "response": None, "error": {"message": str(e)}}
+
+        with ThreadPoolExecutor(max_workers=self.local_workers) as executor:
+            futures = [executor.submit(run, custom_id, body) for custom_id, body, _ in requests]
+            return {result["custom_id"]: result for result in (future.result() for future in futures)}
+
+
+if __name__ == "__main__":
+    pass
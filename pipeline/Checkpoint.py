@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from datetime import datetime
+from loguru import logger
+from pathlib import Path
+from threading import Lock
+
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.trace import span
+
+
+class Checkpoint():
+    def __init__(self, save_dir:str, objects:dict, resume:bool=False):
+        self.save_dir = save_dir
+        self.path = Path(save_dir) / "manifest.json"
+        self.objects = objects
+        self.resume = resume
+        self.lock = Lock()
+        self.manifest = self.load(save_dir)
+
+
+    @staticmethod
+    def load(save_dir:str) -> dict:
+        # Read through the artifact store, so manifests still buffered or only in artifacts.jsonl resume too
+        text = get_artifact_store().read(save_dir, "manifest.json")
+        if text is None:
+            return {"job": {}, "stages": {}}
+        return json.loads(text)
+
+
+    @staticmethod
+    def save_job(save_dir:str, job:dict) -> None:
+        manifest = Checkpoint.load(save_dir)
+        manifest["job"] = job
+        Checkpoint._write(save_dir, manifest)
+
+
+    def run(self, name:str, fn, *args, inputs:list, outputs:list) -> None:
+        inputs_hash = self._hash(inputs)
+        entry = self.manifest["stages"].get(name)
+
+        if self.resume and entry is not None and entry["inputs_hash"] == inputs_hash:
+            for ref, value in entry["outputs"].items():
+                self._set(ref, value)
+            logger.info(f"Stage {name} already completed; restored {', '.join(outputs)} from {self.path}")
+            return
+
+        fn(*args)
+        self.record(name, inputs, outputs, inputs_hash=inputs_hash)
+
+
+    def record(self, name:str, inputs:list, outputs:list, inputs_hash:str=None) -> None:
+        """Mark a stage completed with the current values of its outputs, e.g. when they were produced elsewhere."""
+        # The manifest goes through the same store after the stage's artifacts, so a resumed run never lacks them
+        with self.lock:
+            self.manifest["stages"][name] = {
+                "inputs_hash": inputs_hash or self._hash(inputs),
+                "outputs": {ref: self._get(ref) for ref in outputs},
+                "completed_at": datetime.now().isoformat(),
+            }
+            self._write(self.save_dir, self.manifest)
+
+
+    def _get(self, ref:str):
+        obj_name, attr = ref.split(".", 1)
+        return getattr(self.objects[obj_name], attr)
+
+
+    def _set(self, ref:str, value) -> None:
+        obj_name, attr = ref.split(".", 1)
+        setattr(self.objects[obj_name], attr, value)
+
+
+    def _hash(self, refs:list) -> str:
+        payload = json.dumps({ref: self._get(ref) for ref in refs}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+    @staticmethod
+    def _write(save_dir:str, manifest:dict) -> None:
+        with span("Checkpoint._write", "save", path=str(Path(save_dir) / "manifest.json")):
+            get_artifact_store().write(save_dir, "manifest.json", json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,114 @@
+import math
+import re
+
+from collections import defaultdict, deque
+
+from pipeline.markdown import HEADING, split_blocks
+
+
+def tokenize(text:str) -> list:
+    tokens = re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+    # Cheap singularization so "Linked Lists" and "linked list" match
+    return [token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token for token in tokens]
+
+
+class Automaton():
+    """Aho-Corasick over token sequences: reports every pattern occurring in a token stream in one pass."""
+
+    def __init__(self, patterns:list):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for i, pattern in enumerate(patterns):
+            node = 0
+            for token in pattern:
+                if token not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][token] = len(self.goto) - 1
+                node = self.goto[node][token]
+            self.out[node].append(i)
+
+        # Breadth-first so every failure link points at an already finished, shallower node
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and token not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(token, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+
+    def search(self, tokens:list):
+        node = 0
+        for token in tokens:
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            yield from self.out[node]
+
+
+class ConceptIndex():
+    """Maps concepts to the section that best covers them, built once over a chapter's sections."""
+
+    def __init__(self, sections:list, threshold:float=0.6):
+        self.sections = sections
+        self.threshold = threshold
+        self.headings = []
+        self.bodies = []
+        self.postings = defaultdict(set)
+
+        for i, section in enumerate(sections):
+            blocks = split_blocks(section)
+            self.headings.append(tokenize(" ".join(block for block in blocks if HEADING.match(block))))
+            self.bodies.append(tokenize(" ".join(block for block in blocks if not HEADING.match(block))))
+            for token in self.headings[i] + self.bodies[i]:
+                self.postings[token].add(i)
+
+
+    def match(self, concepts:list) -> dict:
+        """Return {concept: index of its best section, or None when no section covers it}."""
+        patterns = {concept: tuple(tokenize(concept)) for concept in concepts}
+        unique = list(dict.fromkeys(pattern for pattern in patterns.values() if pattern))
+
+        # hits[pattern][section] = [heading occurrences, body occurrences]
+        automaton = Automaton(unique)
+        hits = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        for i in range(len(self.sections)):
+            for where, tokens in enumerate((self.headings[i], self.bodies[i])):
+                for pattern in automaton.search(tokens):
+                    hits[pattern][i][where] += 1
+
+        best = {}
+        for pattern_id, pattern in enumerate(unique):
+            if hits[pattern_id]:
+                # A heading naming the concept beats any number of passing mentions; earlier sections win ties
+                best[pattern] = max(hits[pattern_id], key=lambda i: (*hits[pattern_id][i], -i))
+            else:
+                best[pattern] = self._fuzzy(pattern)
+
+        return {concept: best.get(pattern) for concept, pattern in patterns.items()}
+
+
+    def _fuzzy(self, pattern:tuple):
+        # Fall back to the section containing the largest IDF-weighted share of the concept's tokens
+        weights = {token: math.log(1 + len(self.sections) / (1 + len(self.postings[token]))) for token in set(pattern)}
+        total = sum(weights.values())
+        scores = defaultdict(float)
+        for token, weight in weights.items():
+            for i in self.postings[token]:
+                scores[i] += weight
+
+        if not scores or not total:
+            return None
+        i = max(scores, key=lambda i: (scores[i], -i))
+        return i if scores[i] / total >= self.threshold else None
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,149 @@
+import hashlib
+import sqlite3
+import time
+
+from contextlib import contextmanager
+from loguru import logger
+from pathlib import Path
+
+
+class JobQueue():
+    """(chapter, interest, strategy) jobs in a SQLite file that any number of worker processes claim from."""
+
+    def __init__(self, path:str, stale_after:float=300.0, max_attempts:int=3):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        # Autocommit mode so claims can take the write lock up front with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, chapter TEXT, interest TEXT, strategy TEXT, shard INTEGER, "
+            "state TEXT DEFAULT 'pending', worker TEXT, attempts INTEGER DEFAULT 0, save_dir TEXT, error TEXT, "
+            "heartbeat REAL, claimed_at REAL, finished_at REAL, UNIQUE (chapter, interest, strategy))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state_shard ON jobs (state, shard)")
+
+
+    def add(self, jobs:list, shards:int=1) -> int:
+        """Queue (chapter, interest, strategy) jobs, skipping ones already queued; returns how many were new."""
+        # Siblings of one chapter folder share a shard, so a worker keeps to one part of the tree
+        rows = [(chapter, interest, strategy, int(hashlib.sha256(str(Path(chapter).parent).encode("utf-8")).hexdigest(), 16) % shards) for chapter, interest, strategy in jobs]
+        with self._transaction():
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO jobs (chapter, interest, strategy, shard) VALUES (?, ?, ?, ?)", rows)
+            return self.db.total_changes - before
+
+
+    def claim(self, worker:str, shard:int=None, save_dir_of=None) -> dict:
+        """Atomically take the next pending job, preferring the worker's own shard and stealing from others once it is empty."""
+        now = time.time()
+        with self._transaction():
+            self._reclaim(now)
+
+            row = None
+            if shard is not None:
+                row = self.db.execute("SELECT * FROM jobs WHERE state = 'pending' AND shard = ? ORDER BY id LIMIT 1", (shard,)).fetchone()
+            if row is None:
+                row = self.db.execute("SELECT * FROM jobs WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+
+            # The save_dir is recorded with the claim, so even a worker that dies right away leaves a resumable job
+            save_dir = row["save_dir"] or (save_dir_of(dict(row)) if save_dir_of is not None else None)
+            self.db.execute("UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, save_dir = ?, heartbeat = ?, claimed_at = ? WHERE id = ?", (worker, save_dir, now, now, row["id"]))
+            return {**dict(row), "worker": worker, "attempts": row["attempts"] + 1, "save_dir": save_dir, "resumed": row["save_dir"] is not None}
+
+
+    def heartbeat(self, job_id:int, worker:str, save_dir:str=None) -> bool:
+        """Refresh a running job's lease; False once the job was reclaimed by another worker."""
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET heartbeat = ?, save_dir = COALESCE(?, save_dir) WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), save_dir, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+
+    def finish(self, job_id:int, worker:str, save_dir:str) -> bool:
+        """Mark a running job done; False (and nothing changed) once the job was reclaimed by another worker."""
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = 'done', save_dir = ?, error = NULL, finished_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (save_dir, time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+
+    def fail(self, job_id:int, worker:str, error:str) -> bool:
+        """Requeue (or, out of attempts, fail) a running job; False (and nothing changed) once the job was reclaimed by another worker."""
+        # Failed jobs go back to the queue until they run out of attempts
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = ?, finished_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (self.max_attempts, error, time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+
+    def retry_failed(self) -> int:
+        with self._transaction():
+            return self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0, error = NULL WHERE state = 'failed'").rowcount
+
+
+    def progress(self) -> dict:
+        with self._transaction():
+            self._reclaim(time.time())
+            counts = {row["state"]: row["count"] for row in self.db.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")}
+            first, last = self.db.execute("SELECT MIN(claimed_at), MAX(finished_at) FROM jobs WHERE state = 'done'").fetchone()
+            workers = self.db.execute("SELECT COUNT(DISTINCT worker) FROM jobs WHERE state = 'running'").fetchone()[0]
+
+        total = sum(counts.values())
+        done = counts.get("done", 0)
+        remaining = counts.get("pending", 0) + counts.get("running", 0)
+        elapsed = (last - first) if first is not None and last is not None else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return {
+            "total": total,
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "done": done,
+            "failed": counts.get("failed", 0),
+            "workers": workers,
+            "jobs_per_minute": round(rate * 60, 2),
+            "eta_seconds": round(remaining / rate) if rate > 0 else None,
+        }
+
+
+    def close(self) -> None:
+        self.db.close()
+
+
+    def _reclaim(self, now:float) -> None:
+        # A worker that stopped heartbeating is presumed dead; its job keeps its save_dir so the next worker resumes it
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = 'worker ' || worker || ' stopped heartbeating' "
+            "WHERE state = 'running' AND heartbeat < ?",
+            (self.max_attempts, now - self.stale_after),
+        )
+        if cursor.rowcount:
+            logger.warning(f"Reclaimed {cursor.rowcount} jobs from workers that stopped heartbeating")
+
+
+    @contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+
+if __name__ == "__main__":
+    pass
@@ -1,16 +1,36 @@
-from openai import OpenAI
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from pydantic import BaseModel
 
 from loguru import logger
-from pathlib import Path
 
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.Checkpoint import Checkpoint
+from pipeline.ScoreStore import get_store
+from pipeline.client import get_client
+from pipeline.llm import parse, parse_answered
+from pipeline.markdown import align
+from pipeline.prompt import layout
+from pipeline.trace import traced
+from utils import count_tokens
 
+
+# Shared by Judge.give_feedback and Judge.score and free of the user interest, so the rubric and
+# reference chapter form one cacheable prompt prefix across interests, strategies and both calls
+RUBRIC = "You are an expert in computer science and in the reader's interest named at the end. Please act as an objective judge and evaluate the quality of a modified computer science (CS) textbook chapter outputted by an AI assistant, which explains CS concepts using concepts from the reader's interest. You will be given a reference textbook chapter that explains CS concepts without modifications. Your task is to score the modified textbook on four categories on a scale of 1 to 3, where 1 is unsatisfactory, 2 is semi-satisfactory, and 3 is satisfactory. In your output, include the category, the score, and your explanation for why you gave that score. The categories are:\n\n- All CS concepts from the reference chapter have been accurately explained\n- The interest concepts are sufficiently used\n- The interest concepts are accurately used\n- The interest concepts do not overshadow the CS concepts (the main subject to be taught is CS)\n\nDo not allow the length of the responses to influence your evaluation. Be as objective as possible."
+
+
+@traced
 class Judge():
-    def __init__(self, user_interest:str, reference_text:str, save_dir:str):
-        self.client = OpenAI()
+    def __init__(self, user_interest:str, reference_text:str, save_dir:str, chunk_tokens:int=None, client=None, score_store=None, workers:int=8):
+        self.client = client or get_client()
+        self.score_store = score_store or get_store()
         self.user_interest = user_interest
         self.reference_text = reference_text
         self.save_dir = save_dir
+        self.chunk_tokens = chunk_tokens
+        self.workers = workers
 
         self.final_choice = ""
         self.final_explanation = ""
@@ -30,10 +50,28 @@ class Judge():
         # class EvalsCompetitive(BaseModel):
         #     evals: list[Eval]
         #     summary: str
+
+        # A draft over the chunk budget gets feedback part by part
+        feedback = self._map(self._give_feedback_student, [draft for draft, in self._parts(PLLM.draft)])
+
+        # for eval in res.evals:
+        #     PLLM.judge_feedback += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
+
+        # if compete:
+        #     PLLM_other.judge_summ_opp = res.summary
+        #     self._save_summary(PLLM, PLLM_other)
+
+        PLLM.feedback_student = self._join(feedback)
+        self._save_feedback_student(PLLM)
+
+
+    def _give_feedback_student(self, draft:str) -> str:
         class Evals(BaseModel):
             feedback: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="Judge.give_feedback_student",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -42,23 +80,13 @@ class Judge():
                 },
                 {
                     "role": "user",
-                    "content": f"[The Start of Chapter]\n{PLLM.draft}\n[The End of Chapter]",
+                    "content": f"[The Start of Chapter]\n{draft}\n[The End of Chapter]",
                 },
             ],
             response_format=Evals,
         )
 
-        res = completion.choices[0].message.parsed
-
-        # for eval in res.evals:
-        #     PLLM.judge_feedback += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
-
-        # if compete:
-        #     PLLM_other.judge_summ_opp = res.summary
-        #     self._save_summary(PLLM, PLLM_other)
-
-        PLLM.feedback_student = res.feedback
-        self._save_feedback_student(PLLM)
+        return res.feedback
 
     
     def give_feedback_expert(self, PLLM) -> None:
@@ -75,10 +103,28 @@ class Judge():
         # class EvalsCompetitive(BaseModel):
         #     evals: list[Eval]
         #     summary: str
+
+        # A draft over the chunk budget gets feedback part by part
+        feedback = self._map(self._give_feedback_expert, [draft for draft, in self._parts(PLLM.draft)])
+
+        # for eval in res.evals:
+        #     PLLM.judge_feedback += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
+
+        # if compete:
+        #     PLLM_other.judge_summ_opp = res.summary
+        #     self._save_summary(PLLM, PLLM_other)
+
+        PLLM.feedback_expert = self._join(feedback)
+        self._save_feedback_expert(PLLM)
+
+
+    def _give_feedback_expert(self, draft:str) -> str:
         class Evals(BaseModel):
             feedback: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="Judge.give_feedback_expert",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -87,23 +133,13 @@ class Judge():
                 },
                 {
                     "role": "user",
-                    "content": f"[The Start of Chapter]\n{PLLM.draft}\n[The End of Chapter]",
+                    "content": f"[The Start of Chapter]\n{draft}\n[The End of Chapter]",
                 },
             ],
             response_format=Evals,
         )
 
-        res = completion.choices[0].message.parsed
-
-        # for eval in res.evals:
-        #     PLLM.judge_feedback += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
-
-        # if compete:
-        #     PLLM_other.judge_summ_opp = res.summary
-        #     self._save_summary(PLLM, PLLM_other)
-
-        PLLM.feedback_expert = res.feedback
-        self._save_feedback_expert(PLLM)
+        return res.feedback
 
 
     def give_feedback(self, PLLM, PLLM_other=None, compete:bool=False) -> None:
@@ -121,23 +157,18 @@ class Judge():
             evals: list[Eval]
             summary: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="Judge.give_feedback",
             model="gpt-4o-2024-08-06",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"You are an expert in {self.user_interest} and computer science. Please act as an objective judge and evaluate the quality of a modified computer science (CS) textbook chapter outputted by an AI assistant, which explains CS concepts using {self.user_interest} concepts. You will be given a reference textbook chapter that explains CS concepts without modifications. Your task is to score the modified textbook on four categories on a scale of 1 to 3, where 1 is unsatisfactory, 2 is semi-satisfactory, and 3 is satisfactory. In your output, include the category, the score, and your explanation for why you gave that score. The categories are:\n\n- All CS concepts from the reference chapter have been accurately explained\n- The {self.user_interest} concepts are sufficiently used\n- The {self.user_interest} concepts are accurately used\n- The {self.user_interest} concepts do not overshadow the CS concepts (the main subject to be taught is CS)\n\nDo not allow the length of the responses to influence your evaluation. Be as objective as possible.{' In your output, include a summary of what the AI assistant accomplished in making the modified chapter, as well as what you like and dislike about the modified chapter.' if compete else ''}",
-                },
-                {
-                    "role": "user",
-                    "content": f"[The Start of Reference Chapter]\n{self.reference_text}\n[The End of Reference Chapter]\n\n[The Start of Modified Chapter]\n{PLLM.draft}\n[The End of Modified Chapter]",
-                },
-            ],
+            messages=layout(
+                RUBRIC,
+                f"[The Start of Reference Chapter]\n{self.reference_text}\n[The End of Reference Chapter]",
+                f"[Reader's interest: {self.user_interest}]\n\n[The Start of Modified Chapter]\n{PLLM.draft}\n[The End of Modified Chapter]{' In your output, include a summary of what the AI assistant accomplished in making the modified chapter, as well as what you like and dislike about the modified chapter.' if compete else ''}",
+            ),
             response_format=EvalsCompetitive if compete else Evals,
         )
 
-        res = completion.choices[0].message.parsed
-
         for eval in res.evals:
             PLLM.judge_feedback += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
 
@@ -151,36 +182,69 @@ class Judge():
     def compare(self, PLLM_a, PLLM_b) -> None:
         logger.info("Judge LLM comparing Personalizer outputs...")
 
+        self.final_choice, self.final_explanation = self._compare(PLLM_a, PLLM_b)
+        self._save_verdict()
+
+
+    def _compare(self, PLLM_a, PLLM_b) -> tuple:
+        # Drafts over the chunk budget are compared part by part; the majority of the part verdicts wins
+        parts = self._parts(PLLM_a.final_draft, PLLM_b.final_draft)
+        verdicts = self._map(lambda part: self._compare_part(PLLM_a.name, part[0], PLLM_b.name, part[1]), parts)
+        if len(verdicts) == 1:
+            return verdicts[0]
+
+        votes = Counter(choice for choice, _ in verdicts).most_common()
+        choice = votes[0][0] if len(votes) == 1 or votes[0][1] > votes[1][1] else "TIE"
+        return choice, self._join([f"{part_choice}: {explanation}" for part_choice, explanation in verdicts])
+
+
+    def _compare_part(self, name_a:str, draft_a:str, name_b:str, draft_b:str) -> tuple:
         class Verdict(BaseModel):
             choice: str
             explanation: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="Judge.compare",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
                     "role": "system",
-                    "content": f"Please act as an impartial judge and evaluate the quality of the modified computer science (CS) textbook chapters outputted by two AI assistants. The chapters explain CS concepts using {self.user_interest} concepts. Your evaluation is from the perspective of someone who is interested in {self.user_interest} but is new to the CS concepts. Your job is to evaluate which assistant's chapter is more effective for you to learn CS.\n\nAvoid any position biases and ensure that the order in which the responses were presented does not influence your decision. Do not allow the length of the responses to influence your evaluation. Do not favor certain names of the assistants. Be as objective as possible. After providing your explanation, output your final verdict in the 'choice' field by strictly following this format: '{PLLM_a.name}' if assistant {PLLM_a.name} is better, '{PLLM_b.name}' if assistant {PLLM_b.name} is better, and 'TIE' for a tie. Include a brief explanation of your choice in the output.",
+                    "content": f"Please act as an impartial judge and evaluate the quality of the modified computer science (CS) textbook chapters outputted by two AI assistants. The chapters explain CS concepts using {self.user_interest} concepts. Your evaluation is from the perspective of someone who is interested in {self.user_interest} but is new to the CS concepts. Your job is to evaluate which assistant's chapter is more effective for you to learn CS.\n\nAvoid any position biases and ensure that the order in which the responses were presented does not influence your decision. Do not allow the length of the responses to influence your evaluation. Do not favor certain names of the assistants. Be as objective as possible. After providing your explanation, output your final verdict in the 'choice' field by strictly following this format: '{name_a}' if assistant {name_a} is better, '{name_b}' if assistant {name_b} is better, and 'TIE' for a tie. Include a brief explanation of your choice in the output.",
                 },
                 {
                     "role": "user",
-                    "content": f"[The Start of Assistant {PLLM_a.name}'s Chapter]\n{PLLM_a.final_draft}\n[The End of Assistant {PLLM_a.name}'s Chapter]\n\n[The Start of Assistant {PLLM_b.name}'s Chapter]\n{PLLM_b.final_draft}\n[The End of Assistant {PLLM_b.name}'s Chapter]",
+                    "content": f"[The Start of Assistant {name_a}'s Chapter]\n{draft_a}\n[The End of Assistant {name_a}'s Chapter]\n\n[The Start of Assistant {name_b}'s Chapter]\n{draft_b}\n[The End of Assistant {name_b}'s Chapter]",
                 },
             ],
             response_format=Verdict,
         )
 
-        res = completion.choices[0].message.parsed
+        return res.choice, res.explanation
 
-        self.final_choice = res.choice
-        self.final_explanation = res.explanation
 
-        self._save_verdict()
+    def score(self, PLLM, job:dict=None) -> None:
+        logger.info("Judge LLM scoring...")
 
+        model = "gpt-4o-2024-08-06"
+        # A chapter over the chunk budget is scored part by part against the matching part of the reference
+        parts = self._parts(self.reference_text, PLLM.final_draft)
+        results = self._map(lambda part: self._score(model, *part), parts)
+        evals = [evals for evals, _ in results]
+        PLLM.judge_evals = evals[0] if len(evals) == 1 else self._aggregate(evals, [count_tokens(reference + draft) for reference, draft in parts])
+        for eval in PLLM.judge_evals:
+            PLLM.judge_score += f"# Evaluation category: {eval['category']}\n\nScore: {eval['score']}/3\n\nFeedback: {eval['explanation']}\n\n"
+
+        self._save_score(PLLM)
+        if self.score_store is not None:
+            # Chapter and strategy come from the run's manifest unless the caller knows better
+            job = job if job is not None else Checkpoint.load(self.save_dir)["job"]
+            # The models that actually answered; parts scored by different models (e.g. one escalated) are all named
+            answered = "+".join(sorted({answered for _, answered in results}))
+            self.score_store.add(PLLM.judge_evals, run_dir=self.save_dir, draft=PLLM.name, chapter=job.get("chapter", ""), interest=self.user_interest, strategy=job.get("strategy", ""), model=answered)
 
-    def score(self, PLLM) -> None:
-        logger.info("Judge LLM scoring...")
 
+    def _score(self, model:str, reference:str, draft:str) -> tuple:
         class Eval(BaseModel):
             category: str
             score: int
@@ -189,63 +253,81 @@ class Judge():
         class Evals(BaseModel):
             evals: list[Eval]
 
-        completion = self.client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"You are an expert in {self.user_interest} and computer science. Please act as an objective judge and evaluate the quality of a modified computer science (CS) textbook chapter outputted by an AI assistant, which explains CS concepts using {self.user_interest} concepts. You will be given a reference textbook chapter that explains CS concepts without modifications. Your task is to score the modified textbook on four categories on a scale of 1 to 3, where 1 is unsatisfactory, 2 is semi-satisfactory, and 3 is satisfactory. In your output, include the category, the score, and your explanation for why you gave that score. The categories are:\n\n- All CS concepts from the reference chapter have been accurately explained\n- The {self.user_interest} concepts are sufficiently used\n- The {self.user_interest} concepts are accurately used\n- The {self.user_interest} concepts do not overshadow the CS concepts (the main subject to be taught is CS)\n\nDo not allow the length of the responses to influence your evaluation. Be as objective as possible.",
-                },
-                {
-                    "role": "user",
-                    "content": f"[The Start of Reference Chapter]\n{self.reference_text}\n[The End of Reference Chapter]\n\n[The Start of Modified Chapter]\n{PLLM.final_draft}\n[The End of Modified Chapter]",
-                },
-            ],
+        res, answered = parse_answered(
+            self.client,
+            stage="Judge.score",
+            model=model,
+            messages=layout(
+                RUBRIC,
+                f"[The Start of Reference Chapter]\n{reference}\n[The End of Reference Chapter]",
+                f"[Reader's interest: {self.user_interest}]\n\n[The Start of Modified Chapter]\n{draft}\n[The End of Modified Chapter]",
+            ),
             response_format=Evals,
         )
 
-        res = completion.choices[0].message.parsed
+        return [eval.model_dump() for eval in res.evals], answered
 
-        for eval in res.evals:
-            PLLM.judge_score += f"# Evaluation category: {eval.category}\n\nScore: {eval.score}/3\n\nFeedback: {eval.explanation}\n\n"
 
-        self._save_score(PLLM)
+    @staticmethod
+    def _aggregate(results:list, weights:list) -> list:
+        # The rubric fixes the categories' order, so parts are matched by position; scores are averaged by part size
+        evals = []
+        for i, first in enumerate(results[0]):
+            scored = [(evals_of_part[i], weight) for evals_of_part, weight in zip(results, weights) if i < len(evals_of_part)]
+            total = sum(weight for _, weight in scored) or 1
+            evals.append({
+                "category": first["category"],
+                "score": round(sum(eval["score"] * weight for eval, weight in scored) / total),
+                "explanation": "\n\n".join(f"[Part {k + 1} of {len(results)}] {eval['explanation']}" for k, (eval, _) in enumerate(scored)),
+            })
+        return evals
+
+
+    def _parts(self, *texts) -> list:
+        # Without a budget, or under it, the texts go out whole as before
+        if not self.chunk_tokens or count_tokens("".join(texts)) <= self.chunk_tokens:
+            return [texts]
+        return align(list(texts), self.chunk_tokens)
+
+
+    def _map(self, fn, parts:list) -> list:
+        # Parts are judged concurrently; results are collected in order
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = [executor.submit(copy_context().run, fn, part) for part in parts]
+            return [future.result() for future in futures]
+
+
+    @staticmethod
+    def _join(texts:list) -> str:
+        if len(texts) == 1:
+            return texts[0]
+        return "\n\n".join(f"[Part {i + 1} of {len(texts)}]\n{text}" for i, text in enumerate(texts))
 
 
     def _save_feedback_student(self, PLLM) -> None:
-        Path(f"{self.save_dir}/{PLLM.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{PLLM.name}/feedback_student.md", "w", encoding="utf-8") as file:
-            file.write(PLLM.feedback_student)
-            logger.info(f"Judge feedback for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/feedback_student.md")
+        get_artifact_store().write(self.save_dir, f"{PLLM.name}/feedback_student.md", PLLM.feedback_student)
+        logger.info(f"Judge feedback for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/feedback_student.md")
 
 
     def _save_feedback_expert(self, PLLM) -> None:
-        Path(f"{self.save_dir}/{PLLM.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{PLLM.name}/feedback_expert.md", "w", encoding="utf-8") as file:
-            file.write(PLLM.feedback_expert)
-            logger.info(f"Judge feedback for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/feedback_expert.md")
+        get_artifact_store().write(self.save_dir, f"{PLLM.name}/feedback_expert.md", PLLM.feedback_expert)
+        logger.info(f"Judge feedback for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/feedback_expert.md")
 
 
     def _save_score(self, PLLM) -> None:
-        Path(f"{self.save_dir}/{PLLM.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{PLLM.name}/score.md", "w", encoding="utf-8") as file:
-            file.write(PLLM.judge_score)
-            logger.info(f"Judge scores for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/score.md")
+        get_artifact_store().write(self.save_dir, f"{PLLM.name}/score.md", PLLM.judge_score)
+        logger.info(f"Judge scores for {PLLM.name} saved in {self.save_dir}/{PLLM.name}/score.md")
 
 
     def _save_summary(self, PLLM, PLLM_other) -> None:
-        Path(f"{self.save_dir}/{PLLM_other.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{PLLM_other.name}/opp_summary.md", "w", encoding="utf-8") as file:
-            file.write(PLLM_other.judge_summ_opp)
-            logger.info(f"Judge summary for {PLLM.name} given to {PLLM_other.name} saved in {self.save_dir}/{PLLM_other.name}/opp_summary.md")
+        get_artifact_store().write(self.save_dir, f"{PLLM_other.name}/opp_summary.md", PLLM_other.judge_summ_opp)
+        logger.info(f"Judge summary for {PLLM.name} given to {PLLM_other.name} saved in {self.save_dir}/{PLLM_other.name}/opp_summary.md")
 
 
     def _save_verdict(self) -> None:
-        Path(self.save_dir).mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/verdict.txt", "w", encoding="utf-8") as file:
-            verdict = f"Choice: {self.final_choice}\n\nExplanation:\n{self.final_explanation}"
-            file.write(verdict)
-            logger.info(f"Judge verdict saved in {self.save_dir}/verdict.txt")
+        verdict = f"Choice: {self.final_choice}\n\nExplanation:\n{self.final_explanation}"
+        get_artifact_store().write(self.save_dir, "verdict.txt", verdict)
+        logger.info(f"Judge verdict saved in {self.save_dir}/verdict.txt")
 
 
 if __name__ == "__main__":
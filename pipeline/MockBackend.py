@@ -0,0 +1,143 @@
+import hashlib
+import httpx
+import json
+import random
+import re
+import time
+
+from openai import OpenAI
+from threading import Lock
+
+
+class MockBackend():
+    """Local stand-in for the chat completions API: schema-valid, deterministic responses with simulated latency and failures."""
+
+    def __init__(self, latency:float=0.0, jitter:float=0.0, error_rate:float=0.0, rate_limit_rate:float=0.0, retry_after_ms:int=100, seed:int=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.seed = seed
+
+        self.lock = Lock()
+        self.attempts = {}
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+
+    def client(self, max_retries:int=2) -> OpenAI:
+        # A real OpenAI client over an in-process transport, so parsing, streaming and retries run their normal code paths
+        http_client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        return OpenAI(api_key="mock", base_url="http://mock.local/v1", http_client=http_client, max_retries=max_retries)
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+    def handle(self, request:httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        key = hashlib.sha256(request.content).hexdigest()
+
+        # Same request and attempt number -> same outcome, so runs are reproducible yet retries can succeed
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+            self.requests += 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            with self.lock:
+                self.rate_limited += 1
+            return httpx.Response(429, headers={"retry-after-ms": str(self.retry_after_ms)}, json={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}})
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return httpx.Response(500, json={"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+
+        source = max((message["content"] for message in body["messages"] if message["role"] == "user"), key=len, default="")
+        response_format = body.get("response_format")
+        if response_format:
+            content = json.dumps(self._fake(response_format["json_schema"]["schema"], rng, source))
+        else:
+            content = self._text(source)
+
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4 + 1
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1, "total_tokens": prompt_tokens + len(content) // 4 + 1, "prompt_tokens_details": {"cached_tokens": 0}}
+
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self._events(body["model"], content, usage))
+        return httpx.Response(200, json={
+            "id": f"mock-{key[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content, "refusal": None}}],
+            "usage": usage,
+        })
+
+
+    def _fake(self, schema:dict, rng:random.Random, source:str, name:str="", index:int=0, defs:dict=None):
+        defs = defs if defs is not None else schema.get("$defs", {})
+        if "$ref" in schema:
+            return self._fake(defs[schema["$ref"].split("/")[-1]], rng, source, name, index, defs)
+
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: self._fake(value, rng, source, key, index, defs) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            if name == "sections":
+                return self._sections(source)
+            if name == "concepts":
+                return self._concepts(source, rng)
+            if name == "documents":
+                # Packed requests get one answer per "[The Start of Document N]" block, built from that document alone
+                documents = re.findall(r"\[The Start of Document \d+\]\n(.*?)\n\[The End of Document \d+\]", source, flags=re.DOTALL)
+                return [self._fake(schema["items"], rng, document, name, i, defs) for i, document in enumerate(documents)]
+            return [self._fake(schema["items"], rng, source, name, i, defs) for i in range(rng.randint(2, 4))]
+        if kind == "integer":
+            # Packed responses need each document's position; scores stay on the 1-3 rubric scale
+            return index if name == "id" else rng.randint(1, 3)
+        if kind == "number":
+            return rng.random()
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if name == "choice":
+            return rng.choice(["A", "B", "TIE"])
+        if name == "text":
+            return self._text(source)
+        return f"Mock {name or 'value'} {rng.randint(0, 999)}"
+
+
+    def _text(self, source:str) -> str:
+        # Echo the request's largest input so downstream sectioning and matching see realistic Markdown
+        return source or "# Mock chapter\n\nMock paragraph."
+
+
+    def _sections(self, source:str) -> list:
+        blocks = [block for block in source.split("\n\n") if block.strip()]
+        return ["\n\n".join(blocks[i:i + 3]) for i in range(0, len(blocks), 3)] or [source]
+
+
+    def _concepts(self, source:str, rng:random.Random) -> list:
+        # Headings make plausible concepts that insert_analogies can actually place
+        headings = [line.lstrip("#").strip() for line in source.splitlines() if line.startswith("#") and line.lstrip("#").strip()]
+        return rng.sample(headings, min(len(headings), 4)) or [f"Mock concept {rng.randint(0, 999)}"]
+
+
+    def _events(self, model:str, content:str, usage:dict):
+        for i in range(0, len(content), 64):
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + 64]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8")
+
+
+if __name__ == "__main__":
+    pass
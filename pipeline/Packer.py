@@ -0,0 +1,124 @@
+from collections import defaultdict
+from pydantic import BaseModel
+
+from loguru import logger
+from pathlib import Path
+
+from pipeline.client import get_client
+from pipeline.llm import parse
+from pipeline.prompt import layout
+from utils import count_tokens, read
+
+
+class Packer():
+    """Sends the whole-chapter stages of several small sibling chapters as one multi-document request."""
+
+    def __init__(self, budget:int=6000, model:str="gpt-4o-2024-08-06", client=None):
+        self.client = client or get_client()
+        self.budget = budget
+        self.model = model
+
+
+    def pack(self, sources:list) -> list:
+        """Group files by folder, then greedily fill packs of siblings up to the token budget."""
+        siblings = defaultdict(list)
+        for src in sorted(str(src) for src in sources):
+            siblings[str(Path(src).parent)].append(src)
+
+        packs = []
+        for group in siblings.values():
+            pack = []
+            size = 0
+            for src in group:
+                tokens = count_tokens(read(src), self.model)
+                if pack and size + tokens > self.budget:
+                    packs.append(pack)
+                    pack = []
+                    size = 0
+                # A file over budget on its own still gets a pack of one and runs unpacked
+                pack.append(src)
+                size += tokens
+            if pack:
+                packs.append(pack)
+
+        logger.info(f"Packed {sum(len(pack) for pack in packs)} files into {len(packs)} packs of up to {self.budget} tokens")
+        return packs
+
+
+    def personalize(self, documents:list, user_interest:str) -> list:
+        logger.info(f"Packer personalizing {len(documents)} chapters in one request...")
+
+        class Document(BaseModel):
+            id: int
+            text: str
+
+        class Documents(BaseModel):
+            documents: list[Document]
+
+        res = parse(
+            self.client,
+            stage="Packer.personalize",
+            model=self.model,
+            messages=layout(
+                "You are an expert in computer science (CS) and in the interest named at the end. You will be given several numbered CS textbook chapters (written in Markdown). Your task is to modify the explanations and examples in each chapter independently using concepts from that interest. Ensure the layout of each personalized chapter exactly follows the layout of its original chapter. Do not leave out any paragraph, code block, etc. Output one personalized chapter per document, with the id of the document it personalizes.",
+                self._documents(documents),
+                f"Interest: {user_interest}",
+            ),
+            response_format=Documents,
+        )
+
+        return self._unpack(res.documents, len(documents), lambda document: document.text)
+
+
+    def extract_concepts(self, documents:list) -> list:
+        logger.info(f"Packer extracting concepts of {len(documents)} chapters in one request...")
+
+        class Info(BaseModel):
+            id: int
+            concepts: list[str]
+
+        class Infos(BaseModel):
+            documents: list[Info]
+
+        res = parse(
+            self.client,
+            stage="Packer.extract_concepts",
+            model=self.model,
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a helpful computer science professor. You will be given several numbered computer science textbook chapters written in markdown format. For each chapter independently, extract the main technical concepts taught in it, with the id of the chapter. The main technical concepts are likely in the headers.",
+                },
+                {
+                    "role": "user",
+                    "content": self._documents(documents),
+                },
+            ],
+            response_format=Infos,
+        )
+
+        return self._unpack(res.documents, len(documents), lambda document: document.concepts)
+
+
+    def _documents(self, documents:list) -> str:
+        return "\n\n".join(f"[The Start of Document {i}]\n{document}\n[The End of Document {i}]" for i, document in enumerate(documents))
+
+
+    def _unpack(self, results:list, count:int, value) -> list:
+        # Documents the model skipped or duplicated come back as None and are regenerated unpacked
+        unpacked = [None] * count
+        seen = set()
+        for result in results:
+            if 0 <= result.id < count and result.id not in seen:
+                unpacked[result.id] = value(result)
+                seen.add(result.id)
+
+        missing = count - len(seen)
+        if missing:
+            logger.warning(f"Packed response is missing {missing}/{count} documents; they will run unpacked")
+        return unpacked
+
+
+if __name__ == "__main__":
+    pass
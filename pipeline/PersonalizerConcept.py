@@ -1,23 +1,30 @@
-from openai import OpenAI
 from pydantic import BaseModel
 
 from loguru import logger
-from pathlib import Path
 from tqdm import tqdm
 
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.client import get_client
+from pipeline.llm import parse
+from pipeline.trace import traced
 
+
+@traced
 class PersonalizerConcept():
-    def __init__(self, name:str, user_interest:str, reference_text:str, save_dir:str):
-        self.client = OpenAI()
+    def __init__(self, name:str, user_interest:str, reference_text:str, save_dir:str, analogy_store=None, client=None):
+        self.client = client or get_client()
         self.name = name
         self.user_interest = user_interest
         self.reference_text = reference_text
         self.save_dir = save_dir
+        self.analogy_store = analogy_store
 
         self.concepts = []
         self.draft_dict = {}
         self.draft_chunks = []
         self.draft = ""
+        self.judge_score = ""
+        self.judge_evals = []
 
 
     def extract_concepts(self) -> None:
@@ -26,7 +33,9 @@ class PersonalizerConcept():
         class Info(BaseModel):
             concepts: list[str]
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="PersonalizerConcept.extract_concepts",
             model="gpt-4o-2024-08-06",
             temperature=0,
             messages=[
@@ -42,8 +51,6 @@ class PersonalizerConcept():
             response_format=Info,
         )
 
-        res = completion.choices[0].message.parsed
-
         self.concepts = res.concepts
         self._save_specs()
 
@@ -52,8 +59,13 @@ class PersonalizerConcept():
         logger.info(f"{self.name} personalizing chapter concept-by-concept...")
 
         for concept in tqdm(self.concepts):
-            self.draft_dict[concept] = self._create_analogy(concept)
-            self.draft_chunks.append(self._create_analogy(concept))
+            if self.analogy_store is not None:
+                analogy = self.analogy_store.get_or_create(concept, self.user_interest, self._create_analogy)
+            else:
+                analogy = self._create_analogy(concept)
+
+            self.draft_dict[concept] = analogy
+            self.draft_chunks.append(analogy)
 
         self.draft = "\n\n".join(self.draft_chunks)
         self._save_draft()
@@ -63,7 +75,9 @@ class PersonalizerConcept():
         class Content(BaseModel):
             text: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="PersonalizerConcept.create_analogy",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -78,22 +92,17 @@ class PersonalizerConcept():
             response_format=Content,
         )
 
-        res = completion.choices[0].message.parsed
         return res.text
 
 
     def _save_specs(self) -> None:
-        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{self.name}/specs.txt", "w", encoding="utf-8") as file:
-            file.write(f"{self.concepts}")
-            logger.info(f"Concepts saved in {self.save_dir}/{self.name}/specs.txt")
+        get_artifact_store().write(self.save_dir, f"{self.name}/specs.txt", f"{self.concepts}")
+        logger.info(f"Concepts saved in {self.save_dir}/{self.name}/specs.txt")
 
 
     def _save_draft(self) -> None:
-        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{self.name}/draft.md", "w", encoding="utf-8") as file:
-            file.write(self.draft)
-            logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft.md")
+        get_artifact_store().write(self.save_dir, f"{self.name}/draft.md", self.draft)
+        logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft.md")
 
 
 if __name__ == "__main__":
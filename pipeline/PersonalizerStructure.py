@@ -1,34 +1,72 @@
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from pydantic import BaseModel
 
 from loguru import logger
 from pathlib import Path
 from tqdm import tqdm
 
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.ConceptIndex import ConceptIndex
+from pipeline.client import get_client
+from pipeline.llm import batching, parse, stream
+from pipeline.markdown import chunk, pack, split_sections
+from pipeline.prompt import layout
+from pipeline.trace import traced
+from utils import count_tokens
 
+
+@traced
 class PersonalizerStructure():
-    def __init__(self, name:str, user_interest:str, reference_text:str, save_dir:str):
-        self.client = OpenAI()
+    def __init__(self, name:str, user_interest:str, reference_text:str, save_dir:str, workers:int=8, sectioner:str="llm", stream:bool=False, chunk_tokens:int=None, client=None):
+        self.client = client or get_client()
         self.name = name
         self.user_interest = user_interest
         self.reference_text = reference_text
         self.save_dir = save_dir
+        self.workers = workers
+        self.sectioner = sectioner
+        self.stream = stream
+        self.chunk_tokens = chunk_tokens
 
         self.sections = []
+        self.streamed_sections = []
+        self.section_tokens = {}
         self.draft_chunks = []
         self.draft = ""
         self.feedback_student = ""
         self.feedback_expert = ""
         self.final_draft = ""
+        self.judge_score = ""
+        self.judge_evals = []
+        self.unmatched_concepts = []
 
 
     def extract_sections(self) -> None:
         logger.info(f"{self.name} extracting sections...")
 
+        if self.streamed_sections:
+            # Already sectioned while personalize streamed the draft
+            self.sections, self.streamed_sections = self.streamed_sections, []
+            return
+
+        if self.sectioner == "markdown":
+            # Local split on headings: exact substrings of the draft, no model round-trip
+            self.sections = split_sections(self.draft)
+            return
+
+        # A draft over the chunk budget is sectioned chunk by chunk
+        parts = self._chunks(self.draft)
+        self.sections = [section for sections in self._map(self._extract_sections, parts) for section in sections]
+
+
+    def _extract_sections(self, text:str) -> list:
         class Sections(BaseModel):
             sections: list[str]
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.extract_sections",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -37,65 +75,235 @@ class PersonalizerStructure():
                 },
                 {
                     "role": "user",
-                    "content": f"{self.draft}",
+                    "content": f"{text}",
                 },
             ],
             temperature=0,
             response_format=Sections,
         )
 
-        res = completion.choices[0].message.parsed
-        self.sections = res.sections
+        return res.sections
 
 
     def personalize(self) -> None:
         logger.info(f"{self.name} personalizing chapter with one-to-one mapping...")
 
+        parts = self._chunks(self.reference_text)
+        if len(parts) > 1:
+            self._personalize_chunks(parts)
+            return
+
+        if self.stream and not batching():
+            self._personalize_stream()
+            return
+
+        class Content(BaseModel):
+            text: str
+
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.personalize",
+            model="gpt-4o-2024-08-06",
+            # The chapter comes before the interest so every interest reuses the same cached prefix
+            messages=layout(
+                "You are an expert in computer science (CS) and in the interest named at the end. Your task is to modify the explanations and examples in the provided CS textbook chapter (written in Markdown) using concepts from that interest. Ensure the layout of your personalized chapter exactly follows the layout of the original section. Do not leave out any paragraph, code block, etc.",
+                f"{self.reference_text}",
+                f"Interest: {self.user_interest}",
+            ),
+            response_format=Content,
+        )
+
+        self.draft = res.text
+        self._save_draft()
+
+
+    def _personalize_chunks(self, parts:list) -> None:
+        # Map: every chunk is personalized on its own, in parallel, and reports the analogies it chose
+        logger.info(f"{self.name} personalizing {len(parts)} chunks of at most {self.chunk_tokens} tokens...")
+        results = self._map(self._personalize_chunk, parts)
+        texts = [text for text, _ in results]
+
+        # Reduce: one small call over the analogy lists picks a consistent mapping; only chunks that contradict it are revised
+        mapping, revise = self._reconcile([analogies for _, analogies in results])
+        if revise:
+            logger.info(f"{self.name} revising chunks {revise} for consistent analogies...")
+            revised = self._map(lambda i: self._revise_chunk(texts[i], mapping), revise)
+            for i, text in zip(revise, revised):
+                texts[i] = text
+
+        self.draft = "\n\n".join(text.strip() for text in texts)
+        self._save_draft()
+
+
+    def _personalize_chunk(self, part:str) -> tuple:
+        class Part(BaseModel):
+            text: str
+            analogies: list[str]
+
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.personalize",
+            model="gpt-4o-2024-08-06",
+            messages=layout(
+                "You are an expert in computer science (CS) and in the interest named at the end. Your task is to modify the explanations and examples in the provided part of a longer CS textbook chapter (written in Markdown) using concepts from that interest. Ensure the layout of your personalized part exactly follows the layout of the original part. Do not leave out any paragraph, code block, etc. Also list every analogy you used as 'CS concept -> interest concept'.",
+                f"{part}",
+                f"Interest: {self.user_interest}",
+            ),
+            response_format=Part,
+        )
+
+        return res.text, res.analogies
+
+
+    def _reconcile(self, analogies:list) -> tuple:
+        class Consistency(BaseModel):
+            mapping: list[str]
+            revise: list[int]
+
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.reconcile",
+            model="gpt-4o-2024-08-06",
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"Parts of one computer science (CS) textbook chapter were personalized separately using concepts from {self.user_interest}. Below are the analogies each part used, as 'CS concept -> interest concept'. Output one consistent mapping in which every CS concept maps to exactly one interest concept, and the ids of the parts whose analogies contradict that mapping.",
+                },
+                {
+                    "role": "user",
+                    "content": "\n".join(f"Part {i}: {'; '.join(part)}" for i, part in enumerate(analogies)),
+                },
+            ],
+            response_format=Consistency,
+        )
+
+        return res.mapping, sorted({i for i in res.revise if 0 <= i < len(analogies)})
+
+
+    def _revise_chunk(self, part:str, mapping:list) -> str:
         class Content(BaseModel):
             text: str
 
-        completion = self.client.beta.chat.completions.parse(
+        mapping = "\n".join(mapping)
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.revise_chunk",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
                     "role": "system",
-                    "content": f"You are an expert in computer science (CS) and {self.user_interest}. Your task is to modify the explanations and examples in the provided CS textbook chapter (written in Markdown) using {self.user_interest} concepts. Ensure the layout of your personalized chapter exactly follows the layout of the original section. Do not leave out any paragraph, code block, etc.",
+                    "content": f"You are an expert in computer science (CS) and {self.user_interest}. The part of a personalized CS textbook chapter below must use the same analogies as the rest of the chapter. Output the part with its analogies changed to follow the mapping and only the mapping. Only make minor edits.",
                 },
                 {
                     "role": "user",
-                    "content": f"{self.reference_text}",
+                    "content": f"[The Start of Mapping]\n{mapping}\n[The End of Mapping]\n\n[The Start of Part]\n{part}\n[The End of Part]",
                 },
             ],
             response_format=Content,
         )
 
-        res = completion.choices[0].message.parsed
-        self.draft = res.text
+        return res.text
+
+
+    def _personalize_stream(self) -> None:
+        chunks = []
+        emitted = 0
+        futures = []
+
+        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
+        # Each section (or chunk_tokens part, with the llm sectioner) is sectioned as soon as the stream completes it, overlapping the rest of the generation
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor, open(f"{self.save_dir}/{self.name}/draft.md", "w", encoding="utf-8") as file:
+            for delta in stream(
+                self.client,
+                stage="PersonalizerStructure.personalize",
+                model="gpt-4o-2024-08-06",
+                messages=layout(
+                    "You are an expert in computer science (CS) and in the interest named at the end. Your task is to modify the explanations and examples in the provided CS textbook chapter (written in Markdown) using concepts from that interest. Ensure the layout of your personalized chapter exactly follows the layout of the original section. Do not leave out any paragraph, code block, etc. Output only the personalized chapter.",
+                    f"{self.reference_text}",
+                    f"Interest: {self.user_interest}",
+                ),
+            ):
+                file.write(delta)
+                file.flush()
+                chunks.append(delta)
+
+                # A new line may have started a heading, which completes every section before it
+                if "\n" in delta:
+                    emitted = self._emit_sections("".join(chunks), emitted, executor, futures, final=False)
+
+            self.draft = "".join(chunks).strip()
+            self._emit_sections(self.draft, emitted, executor, futures, final=True)
+
+        # extract_sections picks these up instead of sectioning the whole draft again
+        self.streamed_sections = [section for future in futures for section in future.result()]
         self._save_draft()
 
 
+    def _emit_sections(self, text:str, emitted:int, executor, futures:list, final:bool) -> int:
+        if not final:
+            # A partial last line (e.g. a lone "#" so far) may not be a heading yet, so only completed lines can start a section
+            text = text[:text.rfind("\n") + 1]
+        sections = split_sections(text)
+        complete = sections if final else sections[:-1]
+
+        if self.sectioner == "markdown":
+            # Headings already bound a markdown section
+            for section in complete[emitted:]:
+                futures.append(executor.submit(copy_context().run, split_sections, section))
+            return max(emitted, len(complete))
+
+        # The llm sectioner sees the same parts as extract_sections: the whole draft, or one call per chunk_tokens part
+        # as soon as the stream has completed it, instead of one call per heading
+        if final:
+            parts = self._chunks(text) if emitted == 0 else self._chunks("\n\n".join(complete[emitted:]))
+            for part in parts:
+                futures.append(executor.submit(copy_context().run, self._extract_sections, part))
+            return len(complete)
+
+        pending = complete[emitted:]
+        if not self.chunk_tokens or not pending:
+            return emitted
+        groups = pack(pending, [self._count(section) for section in pending], self.chunk_tokens)
+        for group in groups[:-1]:
+            for part in self._chunks("\n\n".join(group)):
+                futures.append(executor.submit(copy_context().run, self._extract_sections, part))
+            emitted += len(group)
+        return emitted
+
+
+    def _count(self, section:str) -> int:
+        # Completed sections are re-grouped on every streamed line, so their token counts are kept
+        if section not in self.section_tokens:
+            self.section_tokens[section] = count_tokens(section)
+        return self.section_tokens[section]
+
+
     def insert_analogies(self, other):
         text = ""
+        # One pass over all sections instead of a substring scan per concept
+        matches = ConceptIndex(self.sections).match(list(other.draft_dict))
+        self.unmatched_concepts = [concept for concept, i in matches.items() if i is None]
 
         for concept in tqdm(other.draft_dict):
-            section = list(filter(lambda x: concept in x, self.sections))
-
-            if len(section) == 0:
+            if matches[concept] is None:
                 continue
 
-            section = section[0]
+            section = self.sections[matches[concept]]
             analogy = other.draft_dict[concept]
             text += f"{section}\n\n{analogy}\n\n"
 
+        if self.unmatched_concepts:
+            logger.warning(f"{self.name} found no section for {len(self.unmatched_concepts)}/{len(matches)} concepts: {self.unmatched_concepts}")
+
         self.draft_analogy = text
         self.draft = text
         self._save_draft_analogy()
+        self._save_unmatched()
 
 
     def refine_student(self):
-        self.draft = ""
-        for section in tqdm(self.sections):
-            self.draft += f"{self._refine_student(section)}\n\n"
+        self.draft = "".join(f"{text}\n\n" for text in self._map_sections(self._refine_student))
 
 
     def _refine_student(self, section) -> str:
@@ -104,7 +312,9 @@ class PersonalizerStructure():
         class Content(BaseModel):
             text: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.refine_student",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -119,14 +329,29 @@ class PersonalizerStructure():
             response_format=Content,
         )
 
-        res = completion.choices[0].message.parsed
         return res.text
 
 
     def refine_expert(self):
-        self.draft = ""
-        for section in tqdm(self.sections):
-            self.draft += f"{self._refine_expert(section)}\n\n"
+        self.draft = "".join(f"{text}\n\n" for text in self._map_sections(self._refine_expert))
+
+
+    def _map_sections(self, fn) -> list:
+        return self._map(fn, self.sections)
+
+
+    def _map(self, fn, items:list) -> list:
+        # Sections (or chunks) are processed concurrently; results are collected in order
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = [executor.submit(copy_context().run, fn, item) for item in items]
+            return [future.result() for future in tqdm(futures)]
+
+
+    def _chunks(self, text:str) -> list:
+        # Without a budget, or under it, the text goes out whole as before
+        if not self.chunk_tokens or count_tokens(text) <= self.chunk_tokens:
+            return [text]
+        return chunk(text, self.chunk_tokens)
 
 
     def _refine_expert(self, section) -> str:
@@ -135,7 +360,9 @@ class PersonalizerStructure():
         class Content(BaseModel):
             text: str
 
-        completion = self.client.beta.chat.completions.parse(
+        res = parse(
+            self.client,
+            stage="PersonalizerStructure.refine_expert",
             model="gpt-4o-2024-08-06",
             messages=[
                 {
@@ -150,7 +377,6 @@ class PersonalizerStructure():
             response_format=Content,
         )
 
-        res = completion.choices[0].message.parsed
         return res.text
 
 
@@ -160,23 +386,22 @@ class PersonalizerStructure():
 
 
     def _save_draft(self) -> None:
-        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{self.name}/draft.md", "w", encoding="utf-8") as file:
-            file.write(self.draft)
-            logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft.md")
+        get_artifact_store().write(self.save_dir, f"{self.name}/draft.md", self.draft)
+        logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft.md")
 
     def _save_draft_analogy(self) -> None:
-        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{self.name}/draft_analogy.md", "w", encoding="utf-8") as file:
-            file.write(self.draft_analogy)
-            logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft_analogy.md")
+        get_artifact_store().write(self.save_dir, f"{self.name}/draft_analogy.md", self.draft_analogy)
+        logger.info(f"Draft personalized chapter saved in {self.save_dir}/{self.name}/draft_analogy.md")
+
+
+    def _save_unmatched(self) -> None:
+        get_artifact_store().write(self.save_dir, f"{self.name}/unmatched_concepts.txt", "\n".join(self.unmatched_concepts))
+        logger.info(f"Concepts without a matching section saved in {self.save_dir}/{self.name}/unmatched_concepts.txt")
 
 
     def _save_final(self) -> None:
-        Path(f"{self.save_dir}/{self.name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{self.save_dir}/{self.name}/final_draft.md", "w", encoding="utf-8") as file:
-            file.write(self.final_draft)
-            logger.info(f"Final personalized chapter saved in {self.save_dir}/{self.name}/final_draft.md")
+        get_artifact_store().write(self.save_dir, f"{self.name}/final_draft.md", self.final_draft)
+        logger.info(f"Final personalized chapter saved in {self.save_dir}/{self.name}/final_draft.md")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+import random
+import re
+import time
+
+from loguru import logger
+from threading import Condition
+
+
+def parse_duration(value:str) -> float:
+    """Parse OpenAI reset headers such as "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value))
+
+
+class TokenBucket():
+    def __init__(self, per_minute:int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def wait_time(self, amount:float) -> float:
+        # Requests larger than the whole bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class RateLimiter():
+    """Meters requests and estimated tokens against RPM/TPM limits and adapts concurrency AIMD-style."""
+
+    def __init__(self, rpm:int=None, tpm:int=None, max_concurrency:int=64, min_concurrency:int=1, max_attempts:int=8, completion_ratio:float=1.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_attempts = max_attempts
+        self.completion_ratio = completion_ratio
+
+        self.condition = Condition()
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.blocked_until = 0.0
+
+        self.calls = 0
+        self.throttled_count = 0
+        self.error_count = 0
+        self.wait_seconds = 0.0
+
+
+    def cost(self, prompt_tokens:int) -> float:
+        # TPM is charged on prompt plus expected completion; refunded to actual usage on release
+        return prompt_tokens * (1 + self.completion_ratio)
+
+
+    def acquire(self, prompt_tokens:int) -> None:
+        amount = self.cost(prompt_tokens)
+        start = time.monotonic()
+
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                for bucket in (self.requests, self.tokens):
+                    if bucket is not None:
+                        bucket.refill()
+
+                wait = max(
+                    self.blocked_until - now,
+                    self.requests.wait_time(1) if self.requests else 0.0,
+                    self.tokens.wait_time(amount) if self.tokens else 0.0,
+                )
+                if self.active < int(self.limit) and wait <= 0:
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+            if self.requests:
+                self.requests.level -= 1
+            if self.tokens:
+                self.tokens.level -= min(amount, self.tokens.capacity)
+            self.active += 1
+            self.calls += 1
+            self.wait_seconds += time.monotonic() - start
+
+
+    def release(self, prompt_tokens:int, used_tokens:int=None, headers=None) -> None:
+        with self.condition:
+            self.active -= 1
+
+            if used_tokens is not None:
+                # Additive increase: roughly +1 concurrency per `limit` successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                if self.tokens:
+                    self.tokens.level = min(self.tokens.capacity, self.tokens.level + self.cost(prompt_tokens) - used_tokens)
+
+            if headers is not None:
+                self._sync(headers)
+            self.condition.notify_all()
+
+
+    def throttled(self, headers, attempt:int) -> float:
+        """Release a slot after a 429, halve concurrency and return how long the caller should back off."""
+        if headers.get("retry-after-ms"):
+            retry_after = parse_duration(f"{headers['retry-after-ms']}ms")
+        else:
+            retry_after = parse_duration(headers.get("retry-after", ""))
+        delay = retry_after or min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+        with self.condition:
+            self.active -= 1
+            self.throttled_count += 1
+            # Multiplicative decrease
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self._sync(headers)
+            self.condition.notify_all()
+
+        logger.warning(f"Rate limited (attempt {attempt + 1}); backing off {delay:.1f}s, concurrency limit now {int(self.limit)}")
+        return delay
+
+
+    def failed(self, attempt:int) -> float:
+        """Release a slot after a transient server or connection error and return how long the caller should back off."""
+        delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+        # Not a sign of overload on our side, so concurrency stays where it is
+        with self.condition:
+            self.active -= 1
+            self.error_count += 1
+            self.condition.notify_all()
+
+        logger.warning(f"Transient API error (attempt {attempt + 1}); retrying in {delay:.1f}s")
+        return delay
+
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled_count,
+                "errors": self.error_count,
+                "concurrency_limit": int(self.limit),
+                "active": self.active,
+                "wait_seconds": round(self.wait_seconds, 2),
+                "requests_available": round(self.requests.level, 1) if self.requests else None,
+                "tokens_available": round(self.tokens.level, 1) if self.tokens else None,
+            }
+
+
+    def _sync(self, headers) -> None:
+        # Trust the provider's view of the remaining budget when it is lower than ours
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if bucket is None or remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+
+            bucket.level = min(bucket.level, remaining)
+            if remaining <= 0:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + parse_duration(headers.get(f"x-ratelimit-reset-{kind}", "")))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from loguru import logger
+from pathlib import Path
+from threading import Lock
+
+
+class ResponseCache():
+    def __init__(self, cache_dir:str, max_bytes:int=512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = sum(path.stat().st_size for path in self.cache_dir.glob("*/*.json"))
+
+
+    def key(self, model:str, temperature, messages:list, response_format, sample:int=0) -> str:
+        payload = {
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "schema": response_format.model_json_schema(),
+        }
+        # The first sample keeps the key it always had, so existing entries stay valid
+        if sample:
+            payload["sample"] = sample
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+    def get(self, key:str, response_format):
+        path = self._path(key)
+
+        try:
+            data = path.read_text(encoding="utf-8")
+            # Touching the entry keeps mtime ordered by last use for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return response_format.model_validate_json(data)
+
+
+    def put(self, key:str, parsed) -> None:
+        """Store a response; best-effort, since the caller already has (and paid for) it."""
+        path = self._path(key)
+        data = parsed.model_dump_json()
+
+        # Every writer gets its own temp file, so threads missing the same key at once never share one
+        tmp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, suffix=".tmp", delete=False) as file:
+                tmp_path = file.name
+                file.write(data)
+            # Concurrent misses of one key overwrite the same entry; only count its bytes once
+            replaced = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception(f"Could not write response cache entry {path}")
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+            with self.lock:
+                self.write_errors += 1
+            return
+
+        with self.lock:
+            self.size += len(data.encode("utf-8")) - replaced
+            if self.size > self.max_bytes:
+                self._evict()
+
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "write_errors": self.write_errors,
+            "size_bytes": self.size,
+        }
+
+
+    def _path(self, key:str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+
+    def _evict(self) -> None:
+        # Least recently used entries go first until the cache is back under 90% of the cap
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+            self.evictions += 1
+
+        logger.info(f"Response cache evicted down to {self.size} bytes ({self.evictions} evictions so far)")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,101 @@
+import json
+
+from loguru import logger
+from threading import Lock
+
+
+# Mechanical and short stages go to the small model; personalization and refinement keep the call site's model
+PRESETS = {
+    "cheap": {
+        "routes": {
+            "PersonalizerConcept.extract_concepts": "gpt-4o-mini",
+            "PersonalizerStructure.extract_sections": "gpt-4o-mini",
+            "PersonalizerStructure.reconcile": "gpt-4o-mini",
+            "Packer.extract_concepts": "gpt-4o-mini",
+            "Judge.give_feedback_student": "gpt-4o-mini",
+            "Judge.give_feedback_expert": "gpt-4o-mini",
+        },
+        "cascade": [
+            "PersonalizerConcept.extract_concepts",
+            "PersonalizerStructure.extract_sections",
+            "Packer.extract_concepts",
+        ],
+    },
+}
+
+
+def _user_text(kwargs:dict) -> str:
+    return "".join(message["content"] for message in kwargs["messages"] if message["role"] == "user")
+
+
+def _covers(sections:list, kwargs:dict) -> bool:
+    # Sectioning must hand back (nearly) all of the text it was given
+    return bool(sections) and len("".join(sections)) >= 0.8 * len(_user_text(kwargs).strip())
+
+
+# Checks a cheap model's output must pass before it is used; stages without one only need to parse
+VALIDATORS = {
+    "PersonalizerConcept.extract_concepts": lambda parsed, kwargs: bool(parsed.concepts) and all(concept.strip() for concept in parsed.concepts),
+    "PersonalizerStructure.extract_sections": lambda parsed, kwargs: _covers(parsed.sections, kwargs),
+    "Packer.extract_concepts": lambda parsed, kwargs: len(parsed.documents) == _user_text(kwargs).count("[The Start of Document ") and all(document.concepts for document in parsed.documents),
+    "Judge.score": lambda parsed, kwargs: len(parsed.evals) == 4 and all(1 <= eval.score <= 3 for eval in parsed.evals),
+    "Judge.compare": lambda parsed, kwargs: parsed.choice == "TIE" or f"'{parsed.choice}'" in kwargs["messages"][0]["content"],
+}
+
+
+class Router():
+    """Per-stage model routing with an optional cascade that escalates to the call site's model when a cheap output fails validation."""
+
+    def __init__(self, routes:dict=None, cascade:list=None):
+        self.routes = dict(routes or {})
+        self.cascade = set(cascade or [])
+        self.lock = Lock()
+        self.escalations = {}
+
+
+    @staticmethod
+    def load(spec:str, routes:list=None, cascade:list=None):
+        """Build a router from a preset name or JSON file ({"routes": {stage: model}, "cascade": [stage, ...]}) plus STAGE=MODEL overrides."""
+        config = {"routes": {}, "cascade": []}
+        if spec in PRESETS:
+            config = PRESETS[spec]
+        elif spec:
+            with open(spec, "r", encoding="utf-8") as file:
+                config = json.load(file)
+
+        overrides = dict(route.split("=", 1) for route in routes or [])
+        return Router({**config.get("routes", {}), **overrides}, list(config.get("cascade", [])) + list(cascade or []))
+
+
+    def model(self, stage:str, default:str) -> str:
+        # Most specific first: the stage, then its class (e.g. "Judge"), then "*"
+        return self.routes.get(stage) or self.routes.get(stage.split(".")[0]) or self.routes.get("*") or default
+
+
+    def cascades(self, stage:str) -> bool:
+        return stage in self.cascade or stage.split(".")[0] in self.cascade
+
+
+    def validate(self, stage:str, parsed, kwargs:dict) -> bool:
+        if parsed is None:
+            return False
+        validator = VALIDATORS.get(stage)
+        try:
+            return validator is None or validator(parsed, kwargs)
+        except Exception:
+            logger.exception(f"Validator of {stage} failed")
+            return False
+
+
+    def escalated(self, stage:str) -> None:
+        with self.lock:
+            self.escalations[stage] = self.escalations.get(stage, 0) + 1
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"routes": dict(self.routes), "cascade": sorted(self.cascade), "escalations": dict(self.escalations)}
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,108 @@
+import json
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from loguru import logger
+from pipeline.ArtifactStore import get_artifact_store
+from pipeline.trace import span
+
+
+class Stage():
+    def __init__(self, name:str, fn, *args, inputs:list, outputs:list):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+def dependencies(stages:list) -> dict:
+    """Derive each stage's dependencies from declaration order and the state it reads and writes."""
+    deps = {}
+    for i, stage in enumerate(stages):
+        deps[stage.name] = set()
+        for earlier in stages[:i]:
+            reads_after_write = set(stage.inputs) & set(earlier.outputs)
+            writes_after_read = set(stage.outputs) & set(earlier.inputs)
+            writes_after_write = set(stage.outputs) & set(earlier.outputs)
+            if reads_after_write or writes_after_read or writes_after_write:
+                deps[stage.name].add(earlier.name)
+    return deps
+
+
+class Scheduler():
+    def __init__(self, ckpt, save_dir:str, workers:int=4):
+        self.ckpt = ckpt
+        self.save_dir = save_dir
+        self.workers = workers
+        self.timings = {}
+
+
+    def run(self, stages:list) -> None:
+        deps = dependencies(stages)
+        done = set()
+        running = {}
+        self.start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            while len(done) < len(stages):
+                for stage in stages:
+                    if stage.name not in done and stage.name not in running.values() and deps[stage.name] <= done:
+                        running[executor.submit(copy_context().run, self._run_stage, stage)] = stage.name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        # Let stages already in flight finish (and checkpoint) before surfacing the failure
+                        wait(running)
+                        self._report(deps)
+                        raise
+                    done.add(name)
+
+        self._report(deps)
+
+
+    def _run_stage(self, stage:Stage) -> None:
+        start = time.perf_counter()
+        try:
+            with span(stage.name, "stage", save_dir=self.save_dir):
+                self.ckpt.run(stage.name, stage.fn, *stage.args, inputs=stage.inputs, outputs=stage.outputs)
+        finally:
+            self.timings[stage.name] = (start - self.start, time.perf_counter() - self.start)
+
+
+    def _report(self, deps:dict) -> None:
+        if not self.timings:
+            return
+
+        # Walk back from the last stage to finish, always through the dependency that finished last
+        path = []
+        name = max(self.timings, key=lambda name: self.timings[name][1])
+        while name is not None:
+            path.append(name)
+            finished_deps = [dep for dep in deps[name] if dep in self.timings]
+            name = max(finished_deps, key=lambda dep: self.timings[dep][1]) if finished_deps else None
+        path.reverse()
+
+        wall = max(end for _, end in self.timings.values())
+        total = sum(end - start for start, end in self.timings.values())
+        report = {
+            "wall_seconds": round(wall, 3),
+            "serial_seconds": round(total, 3),
+            "critical_path": [{"stage": name, "seconds": round(self.timings[name][1] - self.timings[name][0], 3)} for name in path],
+            "stages": {name: {"start": round(start, 3), "end": round(end, 3), "depends_on": sorted(deps[name])} for name, (start, end) in self.timings.items()},
+        }
+
+        get_artifact_store().write(self.save_dir, "schedule.json", json.dumps(report, indent=2))
+
+        breakdown = " -> ".join(f"{step['stage']} ({step['seconds']:.1f}s)" for step in report["critical_path"])
+        logger.info(f"Stages took {wall:.1f}s wall vs {total:.1f}s serial; critical path: {breakdown}")
+        logger.info(f"Stage schedule saved in {self.save_dir}/schedule.json")
+
+
+if __name__ == "__main__":
+    pass
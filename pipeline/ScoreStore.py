@@ -0,0 +1,159 @@
+import re
+import sqlite3
+
+from argparse import ArgumentParser
+from datetime import datetime
+from loguru import logger
+from pathlib import Path
+from threading import Lock
+
+from pipeline.ArtifactStore import get_artifact_store, runs
+from pipeline.Checkpoint import Checkpoint
+
+
+COLUMNS = ["run_dir", "draft", "chapter", "interest", "strategy", "model", "category", "score", "explanation", "created"]
+GROUPS = ["strategy", "interest", "chapter", "category", "model", "draft"]
+# An interest followed by its run's digits-only timestamp, e.g. "microbiology20241211154524"
+LEGACY_RUN = re.compile(r"^([^\d]+?)(\d{8,})$")
+
+_store = None
+
+
+def set_store(store) -> None:
+    global _store
+    _store = store
+
+
+def get_store():
+    return _store
+
+
+class ScoreStore():
+    """Judge scores as rows of an indexed SQLite table, so aggregates never re-parse score.md."""
+
+    def __init__(self, path:str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "id INTEGER PRIMARY KEY, run_dir TEXT, draft TEXT, chapter TEXT, interest TEXT, strategy TEXT, "
+                "model TEXT, category TEXT, score INTEGER, explanation TEXT, created TEXT)"
+            )
+            for column in ["run_dir, draft", "strategy", "interest", "chapter"]:
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS scores_{column.split(',')[0]} ON scores ({column})")
+
+
+    def add(self, evals:list, run_dir:str, draft:str, chapter:str="", interest:str="", strategy:str="", model:str="") -> None:
+        # Re-scoring a draft replaces its earlier rows rather than double-counting them
+        created = datetime.now().isoformat(timespec="seconds")
+        rows = [(run_dir, draft, chapter, interest, strategy, model, eval["category"], eval["score"], eval["explanation"], created) for eval in evals]
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM scores WHERE run_dir = ? AND draft = ?", (run_dir, draft))
+            self.db.executemany(f"INSERT INTO scores ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        logger.info(f"Judge scores for {draft} stored in {self.path}")
+
+
+    def mean_scores(self, by:str="strategy", **filters) -> list:
+        """Mean score, number of scored drafts and number of evals per value of `by`, optionally filtered by column values."""
+        if by not in GROUPS:
+            raise ValueError(f"Cannot group scores by {by!r}; choose one of {GROUPS}")
+        for column in filters:
+            if column not in GROUPS:
+                raise ValueError(f"Cannot filter scores by {column!r}; choose one of {GROUPS}")
+
+        where = " AND ".join(f"{column} = ?" for column in filters)
+        query = (
+            f"SELECT {by} AS key, AVG(score) AS mean, COUNT(DISTINCT run_dir || '/' || draft) AS drafts, COUNT(*) AS evals "
+            f"FROM scores {'WHERE ' + where if where else ''} GROUP BY {by} ORDER BY mean DESC"
+        )
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, list(filters.values()))]
+
+
+    def mean_score(self, by:str, value:str) -> float:
+        rows = self.mean_scores(by=by, **{by: value})
+        return rows[0]["mean"] if rows else 0.0
+
+
+    def ingest(self, root:str, sources:str="og-textbooks") -> int:
+        """Backfill the store from every score.md already written or stored under root; returns the number of drafts added."""
+        chapters = legacy_chapters(sources)
+        scored = [(path.parent.parent, path.parent.name, path.read_text(encoding="utf-8")) for path in sorted(Path(root).rglob("score.md"))]
+        # Runs on the JSONL artifact store keep their scores in artifacts.jsonl (an export rewrites the same rows)
+        for run_dir, artifacts in runs(root):
+            scored += [(run_dir, name.split("/")[0], text) for name, text in artifacts.items() if name.endswith("/score.md")]
+
+        count = 0
+        for run_dir, draft, text in scored:
+            evals = parse_score(text)
+            if not evals:
+                continue
+
+            # Manifests and strategy.txt may be files or records in the run's artifacts.jsonl
+            job = Checkpoint.load(run_dir)["job"]
+            strategy = get_artifact_store().read(run_dir, "strategy.txt")
+            if not job and strategy is not None:
+                # Runs from before manifest.json: output/<course>/<chapter>/<interest><timestamp>/strategy.txt
+                match = LEGACY_RUN.match(run_dir.name)
+                if match is None:
+                    logger.warning(f"Skipped {run_dir}: not an <interest><timestamp> run directory")
+                    continue
+                chapter = chapters.get(f"{run_dir.parent.parent.name}/{run_dir.parent.name}")
+                if chapter is None:
+                    logger.warning(f"No source chapter under {sources} for {run_dir}; recording its output directory instead")
+                job = {
+                    "chapter": chapter or str(run_dir.parent),
+                    "interest": match.group(1),
+                    "strategy": strategy.removeprefix("Strategy: ").strip(),
+                }
+
+            self.add(evals, run_dir=str(run_dir), draft=draft, chapter=job.get("chapter", ""), interest=job.get("interest", ""), strategy=job.get("strategy", ""))
+            count += 1
+        return count
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+def legacy_chapters(sources:str) -> dict:
+    """Source chapter of every <course>/<chapter> output directory the original gen.py named (e.g. "2.-classes.md" saved under "2--classes")."""
+    chapters = {}
+    for path in sorted(Path(sources).glob("*/*.md")):
+        chapters[f"{path.parent.name}/{'-'.join(path.name.split('.')[:-1])}"] = path.as_posix()
+    return chapters
+
+
+def parse_score(text:str) -> list:
+    """Recover structured evals from the Markdown that Judge.score writes to score.md."""
+    pattern = r"# Evaluation category: (.*?)\n\nScore: (\d+)/3\n\nFeedback: (.*?)(?=\n\n# Evaluation category: |\s*\Z)"
+    return [{"category": category, "score": int(score), "explanation": explanation} for category, score, explanation in re.findall(pattern, text, flags=re.DOTALL)]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("db", help="path/to/scores.db")
+    parser.add_argument("--ingest", dest="ingest", nargs="+", help="Backfill from every score.md found under these directories", default=[])
+    parser.add_argument("--sources", dest="sources", help="Original textbooks that legacy runs (without manifest.json) are mapped back to", default="og-textbooks")
+    parser.add_argument("--by", dest="by", help="Column to average scores over", default="strategy", choices=GROUPS)
+    parser.add_argument("--strategy", dest="strategy", help="Only include this strategy", default=None)
+    parser.add_argument("--interest", dest="interest", help="Only include this interest", default=None)
+    parser.add_argument("--chapter", dest="chapter", help="Only include this chapter", default=None)
+    args = parser.parse_args()
+
+    store = ScoreStore(args.db)
+    for directory in args.ingest:
+        logger.info(f"Ingested {store.ingest(directory, args.sources)} scored drafts from {directory}")
+
+    filters = {column: getattr(args, column) for column in ["strategy", "interest", "chapter"] if getattr(args, column)}
+    print(f"| {args.by} | Mean score | Drafts | Evals |\n|---|---|---|---|")
+    for row in store.mean_scores(by=args.by, **filters):
+        print(f"| {row['key']} | {row['mean']:.2f}/3 | {row['drafts']} | {row['evals']} |")
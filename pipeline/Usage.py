@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+
+from argparse import ArgumentParser
+from loguru import logger
+from pathlib import Path
+from threading import Lock
+
+from pipeline.ArtifactStore import get_artifact_store, runs
+
+
+# USD per 1M tokens: (input, cached input, output)
+PRICES = {
+    "gpt-4o-2024-08-06": (2.50, 1.25, 10.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini-2024-07-18": (0.15, 0.075, 0.60),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+FIELDS = ["chapter", "interest", "strategy", "attempt", "class", "stage", "model", "escalated", "cache_hit", "estimated_prompt_tokens", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "retries", "cost"]
+
+
+def cost(model:str, prompt_tokens:int, completion_tokens:int, cached_tokens:int) -> float:
+    price_in, price_cached, price_out = PRICES.get(model, PRICES["gpt-4o"])
+    return ((prompt_tokens - cached_tokens) * price_in + cached_tokens * price_cached + completion_tokens * price_out) / 1_000_000
+
+
+class UsageRecorder():
+    def __init__(self, chapter:str="", interest:str="", strategy:str=""):
+        self.labels = {"chapter": chapter, "interest": interest, "strategy": strategy}
+        self.records = []
+        self.lock = Lock()
+
+
+    def record(self, stage:str, model:str, estimate:int=0, latency:float=0.0, usage=None, retries:int=0, cache_hit:bool=False, escalated:bool=False) -> None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        record = {
+            **self.labels,
+            "class": stage.split(".")[0],
+            "stage": stage,
+            "model": model,
+            "escalated": escalated,
+            "cache_hit": cache_hit,
+            "estimated_prompt_tokens": estimate,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latency": round(latency, 4),
+            "retries": retries,
+            "cost": cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        }
+
+        with self.lock:
+            self.records.append(record)
+
+
+    def write_report(self, save_dir:str) -> None:
+        with self.lock:
+            records = list(self.records)
+
+        # A resumed run (or a sweep job retried after its worker died) adds its calls to those of the earlier attempts
+        previous = load_report(save_dir)
+        attempts = previous.get("attempts", 1) + 1 if previous is not None else 1
+        records = (previous["calls"] if previous is not None else []) + [{**record, "attempt": attempts} for record in records]
+
+        store = get_artifact_store()
+        store.write(save_dir, "usage.json", json.dumps({**self.labels, "attempts": attempts, "summary": summarize(records), "by_model": summarize(records, by=("stage", "model")), "calls": records}, indent=2))
+        store.write(save_dir, "usage.csv", to_csv(records))
+        log_cached(records)
+        logger.info(f"Usage report saved in {save_dir}/usage.json and {save_dir}/usage.csv")
+
+
+def summarize(records:list, by:tuple=("stage",)) -> dict:
+    summary = {}
+    for record in records:
+        stage = summary.setdefault(" | ".join(record[key] for key in by), {"calls": 0, "cache_hits": 0, "escalations": 0, "estimated_prompt_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency": 0.0, "retries": 0, "cost": 0.0})
+        stage["calls"] += 1
+        stage["cache_hits"] += int(record["cache_hit"])
+        # Reports written before model routing have no escalated column
+        stage["escalations"] += int(record.get("escalated", False))
+        for key in ["estimated_prompt_tokens", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "retries", "cost"]:
+            stage[key] += record[key]
+
+    # Share of prompt tokens served from the provider's prompt cache, and per-call figures for tuning model routes
+    for stage in summary.values():
+        stage["cached_share"] = round(stage["cached_tokens"] / stage["prompt_tokens"], 3) if stage["prompt_tokens"] else 0.0
+        stage["latency_per_call"] = round(stage["latency"] / stage["calls"], 4)
+        stage["cost_per_call"] = stage["cost"] / stage["calls"]
+
+    return dict(sorted(summary.items(), key=lambda item: item[1]["latency"], reverse=True))
+
+
+def log_cached(records:list) -> None:
+    prompt_tokens = sum(record["prompt_tokens"] for record in records)
+    if not prompt_tokens:
+        return
+
+    cached_tokens = sum(record["cached_tokens"] for record in records)
+    saved = sum(record["cached_tokens"] * (PRICES.get(record["model"], PRICES["gpt-4o"])[0] - PRICES.get(record["model"], PRICES["gpt-4o"])[1]) for record in records) / 1_000_000
+    logger.info(f"Prompt cache served {cached_tokens}/{prompt_tokens} prompt tokens ({cached_tokens / prompt_tokens:.1%}), saving ${saved:.4f}")
+
+
+def to_csv(records:list) -> str:
+    buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue()
+
+
+def load_report(save_dir:str) -> dict:
+    """A run's usage.json, whether it was written as a file or into the run's artifacts.jsonl; None if it has none yet."""
+    text = get_artifact_store().read(save_dir, "usage.json")
+    return json.loads(text) if text is not None else None
+
+
+def load_calls(save_dir:str) -> list:
+    report = load_report(save_dir)
+    return report["calls"] if report is not None else []
+
+
+def aggregate(save_dirs:list, out_dir:str) -> dict:
+    records = []
+    attempts = 0
+    for save_dir in save_dirs:
+        # Every attempt's calls (first run, resumes, retries) were paid for
+        report = load_report(save_dir)
+        if report is not None:
+            records.extend(report["calls"])
+            attempts += report.get("attempts", 1)
+
+    summary = summarize(records)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with open(f"{out_dir}/usage_report.json", "w", encoding="utf-8") as file:
+        json.dump({"runs": len(save_dirs), "attempts": attempts, "summary": summary, "by_model": summarize(records, by=("stage", "model"))}, file, indent=2)
+    with open(f"{out_dir}/usage_report.csv", "w", encoding="utf-8", newline="") as file:
+        file.write(to_csv(records))
+    log_cached(records)
+    logger.info(f"Aggregated usage of {len(save_dirs)} runs saved in {out_dir}/usage_report.json and {out_dir}/usage_report.csv")
+
+    return summary
+
+
+def print_table(summary:dict) -> None:
+    print("| Stage | Model | Calls | Escalations | Latency/call | Cost/call | Cost |\n|---|---|---|---|---|---|---|")
+    for key, stage in sorted(summary.items(), key=lambda item: item[1]["cost"], reverse=True):
+        name, _, model = key.partition(" | ")
+        print(f"| {name} | {model} | {stage['calls']} | {stage['escalations']} | {stage['latency_per_call']:.2f}s | ${stage['cost_per_call']:.5f} | ${stage['cost']:.4f} |")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("roots", nargs="+", help="Directories searched for usage.json reports (as files or in artifacts.jsonl)")
+    args = parser.parse_args()
+
+    # Per stage and model, so routes can be tuned against each stage's latency and cost
+    records = []
+    for root in args.roots:
+        save_dirs = {path.parent for path in Path(root).rglob("usage.json")} | {run_dir for run_dir, artifacts in runs(root) if "usage.json" in artifacts}
+        for save_dir in sorted(save_dirs):
+            records.extend(load_calls(save_dir))
+    print_table(summarize(records, by=("stage", "model")))
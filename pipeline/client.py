@@ -0,0 +1,68 @@
+import httpx
+
+from importlib.util import find_spec
+from openai import OpenAI
+from threading import Lock
+
+
+_lock = Lock()
+_client = None
+_http_client = None
+_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 600.0,
+    "http2": find_spec("h2") is not None,
+}
+
+
+def configure(**settings) -> None:
+    """Set pool options (max_connections, max_keepalive_connections, keepalive_expiry, timeout, http2) before first use."""
+    with _lock:
+        if _client is not None:
+            raise RuntimeError("The shared OpenAI client was already created; configure it before building any pipeline objects")
+        _settings.update({key: value for key, value in settings.items() if value is not None})
+
+
+def set_client(client) -> None:
+    global _client, _http_client
+    with _lock:
+        _client = client
+        _http_client = None
+
+
+def get_client() -> OpenAI:
+    """Process-wide OpenAI client, so every pipeline object reuses one keep-alive connection pool."""
+    global _client, _http_client
+    with _lock:
+        if _client is None:
+            limits = httpx.Limits(
+                max_connections=_settings["max_connections"],
+                max_keepalive_connections=_settings["max_keepalive_connections"],
+                keepalive_expiry=_settings["keepalive_expiry"],
+            )
+            _http_client = httpx.Client(limits=limits, timeout=httpx.Timeout(_settings["timeout"], connect=10.0), http2=_settings["http2"])
+            _client = OpenAI(http_client=_http_client)
+        return _client
+
+
+def pool_stats() -> dict:
+    if _http_client is None:
+        return {}
+
+    # httpcore keeps these private; read defensively so stats never break a run
+    pool = getattr(_http_client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    return {
+        "max_connections": _settings["max_connections"],
+        "http2": _settings["http2"],
+        "connections": len(connections),
+        "active": sum(1 for connection in connections if not connection.is_idle()),
+        "idle": sum(1 for connection in connections if connection.is_idle()),
+        "queued_requests": len(getattr(pool, "_requests", [])),
+    }
+
+
+if __name__ == "__main__":
+    pass
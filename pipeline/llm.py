@@ -0,0 +1,263 @@
+import time
+
+from contextvars import ContextVar
+from loguru import logger
+from openai import APIConnectionError, APIStatusError, ContentFilterFinishReasonError, LengthFinishReasonError, RateLimitError
+from openai.types.chat import ChatCompletion
+from pydantic import ValidationError
+from threading import Lock
+
+from pipeline.trace import span
+from utils import count_tokens
+
+
+_lock = Lock()
+_in_flight = 0
+_cache = None
+_recorder = ContextVar("recorder", default=None)
+_sample = ContextVar("sample", default=0)
+_batch = None
+_limiter = None
+_router = None
+
+
+def in_flight() -> int:
+    return _in_flight
+
+
+def set_cache(cache) -> None:
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
+
+
+def set_batch(batch) -> None:
+    global _batch
+    _batch = batch
+
+
+def set_limiter(limiter) -> None:
+    global _limiter
+    _limiter = limiter
+
+
+def get_limiter():
+    return _limiter
+
+
+def set_router(router) -> None:
+    global _router
+    _router = router
+
+
+def get_router():
+    return _router
+
+
+def routed(stage:str, model:str) -> str:
+    """The model a stage's calls go to (before any cascade escalation)."""
+    return _router.model(stage, model) if _router is not None else model
+
+
+def batching() -> bool:
+    return _batch is not None
+
+
+def set_recorder(recorder):
+    # Context-local so concurrent jobs (and their section threads) each report into their own recorder
+    return _recorder.set(recorder)
+
+
+def reset_recorder(token) -> None:
+    _recorder.reset(token)
+
+
+def set_sample(index:int):
+    # Independent samples of one request (e.g. judge replicates) are cached apart instead of collapsing into one response
+    return _sample.set(index)
+
+
+def reset_sample(token) -> None:
+    _sample.reset(token)
+
+
+def parse(client, stage:str, **kwargs):
+    return parse_answered(client, stage, **kwargs)[0]
+
+
+def parse_answered(client, stage:str, **kwargs) -> tuple:
+    """Like parse, but returns (parsed, model) with the model that actually answered: the routed one, or the call site's after an escalation."""
+    if _router is None:
+        return _parse(client, stage, **kwargs), kwargs["model"]
+
+    model = _router.model(stage, kwargs["model"])
+    if model == kwargs["model"] or not _router.cascades(stage):
+        return _parse(client, stage, **{**kwargs, "model": model}), model
+
+    # Cascade: the routed (cheap) model first, the call site's model only when its output fails validation
+    try:
+        parsed = _parse(client, stage, **{**kwargs, "model": model})
+        if _router.validate(stage, parsed, kwargs):
+            return parsed, model
+        reason = "failed validation"
+    except (ValidationError, LengthFinishReasonError, ContentFilterFinishReasonError) as e:
+        reason = f"could not be parsed ({type(e).__name__})"
+
+    logger.warning(f"{stage}: {model} output {reason}; escalating to {kwargs['model']}")
+    _router.escalated(stage)
+    return _parse(client, stage, escalated=True, **kwargs), kwargs["model"]
+
+
+def _parse(client, stage:str, escalated:bool=False, **kwargs):
+    global _in_flight
+    recorder = _recorder.get()
+    estimate = 0
+    if recorder is not None or _limiter is not None:
+        estimate = count_tokens("".join(message["content"] for message in kwargs["messages"]), kwargs["model"])
+
+    key = None
+    if _cache is not None:
+        key = _cache.key(kwargs["model"], kwargs.get("temperature"), kwargs["messages"], kwargs["response_format"], sample=_sample.get())
+        parsed = _cache.get(key, kwargs["response_format"])
+        if parsed is not None:
+            if recorder is not None:
+                recorder.record(stage, kwargs["model"], estimate=estimate, cache_hit=True, escalated=escalated)
+            return parsed
+
+    with _lock:
+        _in_flight += 1
+
+    start = time.perf_counter()
+    try:
+        with span(stage, "model", model=kwargs["model"], estimated_prompt_tokens=estimate):
+            if _limiter is not None and _batch is None:
+                parsed, usage, retries = _limited(client, stage, kwargs, estimate)
+            else:
+                parsed, usage, retries, _ = _request(client, stage, kwargs)
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+    if recorder is not None:
+        recorder.record(stage, kwargs["model"], estimate=estimate, latency=time.perf_counter() - start, usage=usage, retries=retries, escalated=escalated)
+
+    if key is not None and parsed is not None:
+        _cache.put(key, parsed)
+
+    return parsed
+
+
+def stream(client, stage:str, **kwargs):
+    """Yield the text of a plain (unstructured) completion as it arrives."""
+    global _in_flight
+    # Streamed text reaches the caller as it arrives, so it is routed but never cascaded
+    kwargs["model"] = routed(stage, kwargs["model"])
+    recorder = _recorder.get()
+    estimate = 0
+    if recorder is not None or _limiter is not None:
+        estimate = count_tokens("".join(message["content"] for message in kwargs["messages"]), kwargs["model"])
+    if _limiter is not None:
+        client = client.with_options(max_retries=0)
+
+    with _lock:
+        _in_flight += 1
+
+    start = time.perf_counter()
+    usage = None
+    attempt = 0
+    try:
+        with span(stage, "model", model=kwargs["model"], estimated_prompt_tokens=estimate, stream=True):
+            # Rate limits and server errors surface when the stream is opened, so only that part is retried
+            while True:
+                if _limiter is not None:
+                    _limiter.acquire(estimate)
+                try:
+                    response = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+                    break
+                except RateLimitError as e:
+                    if _limiter is None or attempt == _limiter.max_attempts - 1:
+                        if _limiter is not None:
+                            _limiter.release(estimate)
+                        raise
+                    time.sleep(_limiter.throttled(e.response.headers, attempt))
+                    attempt += 1
+                except (APIStatusError, APIConnectionError) as e:
+                    if _limiter is None or not _transient(e) or attempt == _limiter.max_attempts - 1:
+                        if _limiter is not None:
+                            _limiter.release(estimate)
+                        raise
+                    time.sleep(_limiter.failed(attempt))
+                    attempt += 1
+                except Exception:
+                    if _limiter is not None:
+                        _limiter.release(estimate)
+                    raise
+
+            try:
+                for chunk in response:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                if _limiter is not None:
+                    _limiter.release(estimate, usage.total_tokens if usage else None)
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+    if recorder is not None:
+        recorder.record(stage, kwargs["model"], estimate=estimate, latency=time.perf_counter() - start, usage=usage, retries=attempt)
+
+
+def _request(client, stage:str, kwargs:dict):
+    if _batch is not None:
+        # Blocks until the batch holding this request has been processed
+        completion = ChatCompletion.model_validate(_batch.submit(stage, kwargs))
+        # BatchRunner has already failed refused and empty results, naming their custom_id
+        parsed = kwargs["response_format"].model_validate_json(completion.choices[0].message.content)
+        return parsed, completion.usage, 0, None
+
+    raw = client.beta.chat.completions.with_raw_response.parse(**kwargs)
+    completion = raw.parse()
+    return completion.choices[0].message.parsed, completion.usage, raw.retries_taken, raw.headers
+
+
+def _transient(e:Exception) -> bool:
+    # What the SDK would have retried on its own: connection errors, timeouts and 5xx
+    return isinstance(e, APIConnectionError) or (isinstance(e, APIStatusError) and e.status_code >= 500)
+
+
+def _limited(client, stage:str, kwargs:dict, estimate:int):
+    # The limiter owns retries (429s, 5xx and connection errors), so the client's own retry loop is switched off
+    client = client.with_options(max_retries=0)
+
+    for attempt in range(_limiter.max_attempts):
+        _limiter.acquire(estimate)
+        try:
+            parsed, usage, _, headers = _request(client, stage, kwargs)
+        except RateLimitError as e:
+            if attempt == _limiter.max_attempts - 1:
+                _limiter.release(estimate)
+                raise
+            time.sleep(_limiter.throttled(e.response.headers, attempt))
+            continue
+        except (APIStatusError, APIConnectionError) as e:
+            if not _transient(e) or attempt == _limiter.max_attempts - 1:
+                _limiter.release(estimate)
+                raise
+            time.sleep(_limiter.failed(attempt))
+            continue
+        except Exception:
+            _limiter.release(estimate)
+            raise
+
+        _limiter.release(estimate, usage.total_tokens if usage else 0, headers)
+        return parsed, usage, attempt
+
+
+if __name__ == "__main__":
+    pass
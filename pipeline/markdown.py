@@ -0,0 +1,159 @@
+import re
+
+from utils import count_tokens
+
+
+HEADING = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+
+def split_blocks(text:str) -> list:
+    """Split Markdown into blocks (headings, paragraphs, fenced code, ...), each an exact substring of text."""
+    blocks = []
+    start = None
+    fence = None
+    offset = 0
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        match = FENCE.match(line)
+
+        if fence is not None:
+            # Inside a fenced code block nothing ends the block except the closing fence
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) and stripped == match.group(1):
+                blocks.append(text[start:offset + len(line)].rstrip())
+                start = None
+                fence = None
+        elif match:
+            if start is not None:
+                blocks.append(text[start:offset].rstrip())
+            start = offset
+            fence = match.group(1)
+        elif not stripped:
+            if start is not None:
+                blocks.append(text[start:offset].rstrip())
+                start = None
+        elif HEADING.match(line):
+            if start is not None:
+                blocks.append(text[start:offset].rstrip())
+            blocks.append(line.rstrip())
+            start = None
+        elif start is None:
+            start = offset
+
+        offset += len(line)
+
+    if start is not None:
+        blocks.append(text[start:].rstrip())
+
+    return [block for block in blocks if block.strip()]
+
+
+def split_sections(text:str) -> list:
+    """Group Markdown into sections that start at headings; each section is an exact substring of text."""
+    starts = [0]
+    offset = 0
+    fence = None
+
+    for line in text.splitlines(keepends=True):
+        match = FENCE.match(line)
+        if fence is not None:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) and line.strip() == match.group(1):
+                fence = None
+        elif match:
+            fence = match.group(1)
+        elif HEADING.match(line) and offset > 0:
+            starts.append(offset)
+        offset += len(line)
+
+    spans = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        if not text[start:end].strip():
+            continue
+
+        # A heading with no body (e.g. a chapter title right above a subsection) joins the next section
+        if spans and len(split_blocks(text[spans[-1][0]:spans[-1][1]])) < 2:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+
+    sections = [text[start:end].strip() for start, end in spans]
+    return sections
+
+
+def chunk(text:str, budget:int, model:str="gpt-4o-2024-08-06") -> list:
+    """Pack consecutive sections into chunks of at most budget tokens; an oversized section is packed block by block."""
+    units = []
+    for section in split_sections(text):
+        if count_tokens(section, model) <= budget:
+            units.append(section)
+        else:
+            # A single block over budget (e.g. a long code listing) still becomes a chunk of its own
+            units.extend(split_blocks(section))
+
+    groups = pack(units, [count_tokens(unit, model) for unit in units], budget)
+    return ["\n\n".join(group) for group in groups]
+
+
+def align(texts:list, budget:int, model:str="gpt-4o-2024-08-06") -> list:
+    """Split versions of one chapter (e.g. reference and drafts) into tuples of matching chunks whose combined size fits budget tokens."""
+    sections = [split_sections(text) or [text] for text in texts]
+    count = max(len(versions) for versions in sections)
+
+    # Personalized drafts keep the reference's headings, so sections usually pair one to one;
+    # otherwise each version's sections are spread over the most finely sectioned version's by relative position
+    columns = [spread(versions, count) for versions in sections]
+    sizes = [sum(count_tokens(section, model) for column in columns for section in column[i]) for i in range(count)]
+
+    groups = pack(list(range(count)), sizes, budget)
+    return [tuple("\n\n".join(section for i in group for section in column[i]) for column in columns) for group in groups]
+
+
+def spread(items:list, count:int) -> list:
+    """Distribute items over count consecutive groups by relative position; with fewer items than groups, some groups are empty."""
+    return [items[round(i * len(items) / count):round((i + 1) * len(items) / count)] for i in range(count)]
+
+
+def regroup(drafted:list, sections:list) -> list:
+    """Assign the sections of a draft to the reference sections whose heading they share; returns one text per reference section ("" when none)."""
+    headings = [_heading(section) for section in sections]
+    groups = [[] for _ in sections]
+    current = 0
+
+    # Drafts keep the reference's headings but may reorder sections (e.g. insert_analogies), so pair them by heading, not position;
+    # a section whose heading the reference lacks stays with the section before it, so no drafted text is lost
+    for section in drafted:
+        heading = _heading(section)
+        matches = [i for i, candidate in enumerate(headings) if heading is not None and candidate == heading]
+        if matches:
+            current = next((i for i in matches if i > current), matches[0])
+        groups[current].append(section)
+
+    return ["\n\n".join(group) for group in groups]
+
+
+def _heading(section:str) -> str:
+    first = section.lstrip().splitlines()[0] if section.strip() else ""
+    return " ".join(first.strip().lstrip("#").lower().split()) if HEADING.match(first) else None
+
+
+def pack(units:list, sizes:list, budget:int) -> list:
+    """Group consecutive units into lists whose sizes sum to at most budget; a unit over budget gets a group of its own."""
+    # Greedy: close the current group when the next unit would overflow it
+    groups = []
+    group = []
+    size = 0
+    for unit, tokens in zip(units, sizes):
+        if group and size + tokens > budget:
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(unit)
+        size += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,21 @@
+def layout(instructions:str, stable:str, variable:str) -> list:
+    """Order chat messages for provider prompt caching: fixed instructions, then large shared content, then what changes per request."""
+    # Cached prefixes only match from the first token, so nothing request-specific may appear before `stable`
+    return [
+        {
+            "role": "system",
+            "content": instructions,
+        },
+        {
+            "role": "user",
+            "content": stable,
+        },
+        {
+            "role": "user",
+            "content": variable,
+        },
+    ]
+
+
+if __name__ == "__main__":
+    pass
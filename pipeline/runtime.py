@@ -0,0 +1,59 @@
+from argparse import ArgumentParser
+from loguru import logger
+
+from pipeline import client, llm
+from pipeline.ArtifactStore import JsonlStore, set_artifact_store
+from pipeline.MockBackend import MockBackend
+from pipeline.RateLimiter import RateLimiter
+from pipeline.ResponseCache import ResponseCache
+from pipeline.Router import Router
+from pipeline.ScoreStore import ScoreStore, set_store
+
+
+def add_runtime_args(parser:ArgumentParser) -> None:
+    """Flags every entry point shares: connection pool, mock backend, rate limits, response cache, model routing, score database and artifact store."""
+    parser.add_argument("--max-connections", dest="max_connections", help="Size of the shared HTTP connection pool (per process)", type=int, default=None)
+    parser.add_argument("--max-keepalive", dest="max_keepalive", help="Idle keep-alive connections kept in the pool", type=int, default=None)
+    parser.add_argument("--mock", dest="mock", help="Answer every model call from the local mock backend instead of the API", action="store_true")
+    parser.add_argument("--rpm", dest="rpm", help="Requests-per-minute limit shared by all model calls (per process)", type=int, default=None)
+    parser.add_argument("--tpm", dest="tpm", help="Tokens-per-minute limit shared by all model calls (per process)", type=int, default=None)
+    parser.add_argument("--max-concurrency", dest="max_concurrency", help="Upper bound for the limiter's adaptive concurrency", type=int, default=64)
+    parser.add_argument("--cache-dir", dest="cache_dir", help="Reuse LLM responses for identical requests from this on-disk cache", default=None)
+    parser.add_argument("--cache-size-mb", dest="cache_size_mb", help="Size cap of the response cache in MB", type=int, default=512)
+    parser.add_argument("--routes", dest="routes", help="Per-stage model routing: a preset (cheap) or a JSON file of {\"routes\": {stage: model}, \"cascade\": [stage, ...]}", default=None)
+    parser.add_argument("--route", dest="route", nargs="+", help="Route one stage (or class, or *) to a model, e.g. Judge.give_feedback_student=gpt-4o-mini", default=[])
+    parser.add_argument("--cascade", dest="cascade", nargs="+", help="Stages whose routed model escalates to the default model when its output fails validation", default=[])
+    parser.add_argument("--score-db", dest="score_db", help="Also store every Judge score in this SQLite database", default=None)
+    parser.add_argument("--artifacts", dest="artifacts", help="How stage outputs are stored: files (one per artifact) or jsonl (one buffered, append-only artifacts.jsonl per run; materialize with python -m pipeline.ArtifactStore export)", default="files", choices=["files", "jsonl"])
+
+
+def configure(args) -> None:
+    """Install what the runtime flags ask for; call once per process, before building any pipeline objects."""
+    client.configure(max_connections=args.max_connections, max_keepalive_connections=args.max_keepalive)
+    if args.mock:
+        client.set_client(MockBackend().client())
+    if args.rpm or args.tpm:
+        llm.set_limiter(RateLimiter(rpm=args.rpm, tpm=args.tpm, max_concurrency=args.max_concurrency))
+    if args.cache_dir:
+        llm.set_cache(ResponseCache(args.cache_dir, max_bytes=args.cache_size_mb * 1024 * 1024))
+    if args.routes or args.route or args.cascade:
+        llm.set_router(Router.load(args.routes, args.route, args.cascade))
+
+    if args.score_db:
+        set_store(ScoreStore(args.score_db))
+    if args.artifacts == "jsonl":
+        set_artifact_store(JsonlStore())
+
+
+def log_stats() -> None:
+    if llm.get_cache() is not None:
+        logger.info(f"Response cache stats: {llm.get_cache().stats()}")
+    logger.info(f"Connection pool stats: {client.pool_stats()}")
+    if llm.get_limiter() is not None:
+        logger.info(f"Rate limiter stats: {llm.get_limiter().stats()}")
+    if llm.get_router() is not None:
+        logger.info(f"Model router stats: {llm.get_router().stats()}")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,101 @@
+import inspect
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from loguru import logger
+from pathlib import Path
+
+
+_tracer = None
+# nullcontext keeps no state, so one instance serves every untraced span
+_untraced = nullcontext()
+
+
+class Tracer():
+    """Collects spans and exports them as Chrome trace / Perfetto JSON."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+
+
+    def add(self, name:str, cat:str, start:float, end:float, args:dict) -> None:
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": round((start - self.start) * 1_000_000, 1),
+            "dur": round((end - start) * 1_000_000, 1),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(event)
+
+
+    def export(self, path:str) -> None:
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file)
+            logger.info(f"Trace of {len(events)} spans saved in {path} (open in ui.perfetto.dev or chrome://tracing)")
+
+
+def set_tracer(tracer) -> None:
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+@contextmanager
+def _span(tracer:Tracer, name:str, cat:str, args:dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, cat, start, time.perf_counter(), args)
+
+
+def span(name:str, cat:str, **args):
+    # Tracing off costs one global lookup
+    if _tracer is None:
+        return _untraced
+    return _span(_tracer, name, cat, args)
+
+
+def traced(cls):
+    """Class decorator: a span around every public method and every _save_* method."""
+    for name, fn in list(vars(cls).items()):
+        if inspect.isfunction(fn) and (not name.startswith("_") or name.startswith("_save")):
+            setattr(cls, name, _wrap(f"{cls.__name__}.{name}", "save" if name.startswith("_save") else "method", fn))
+    return cls
+
+
+def _wrap(qualname:str, cat:str, fn):
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if _tracer is None:
+            return fn(self, *args, **kwargs)
+        with _span(_tracer, qualname, cat, {"object": getattr(self, "name", ""), "save_dir": getattr(self, "save_dir", "")}):
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,128 @@
+import os
+import socket
+import time
+
+from argparse import ArgumentParser
+from datetime import timedelta
+from dotenv import load_dotenv
+from loguru import logger
+from multiprocessing import Pipe, Process
+from pathlib import Path
+
+from gen import STRATEGIES, get_save_dir, main
+from generate_full_61b_textbook import INTERESTS
+from pipeline.AnalogyStore import AnalogyStore
+from pipeline.JobQueue import JobQueue
+from pipeline.runtime import add_runtime_args, configure
+
+
+def run_job(args, job:dict, sender) -> None:
+    # Each job runs in its own process, so one whose lease was lost can be stopped outright
+    load_dotenv()
+    # Limits and pools belong to the job's process; a worker runs one job at a time, so divide the account's limits across workers
+    configure(args)
+    analogy_store = AnalogyStore(args.analogy_store) if args.analogy_store else None
+
+    try:
+        main(job["chapter"], job["interest"], job["strategy"], job["save_dir"], section_workers=args.section_workers, analogy_store=analogy_store, resume=job["resumed"], sectioner=args.sectioner, chunk_tokens=args.chunk_tokens, stage_workers=args.stage_workers)
+    except Exception as e:
+        logger.exception(f"Job {job['id']} failed")
+        sender.send(f"{type(e).__name__}: {e}")
+    else:
+        sender.send(None)
+
+
+def work(args, index:int) -> None:
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    shard = (args.shard + index) % args.shards if args.shard is not None else None
+    queue = JobQueue(args.db, stale_after=args.stale_after, max_attempts=args.max_attempts)
+    logger.info(f"Worker {worker} started (shard {shard})")
+
+    while True:
+        # Strategies of one chapter and interest can start in the same second, so the strategy is part of the save_dir;
+        # a job reclaimed from a dead worker keeps the save_dir that worker was given and resumes in it
+        job = queue.claim(worker, shard=shard, save_dir_of=lambda job: f"{get_save_dir(job['chapter'], job['interest'])}_{job['strategy']}")
+        if job is None:
+            logger.info(f"Worker {worker} found no pending jobs; exiting")
+            break
+
+        logger.info(f"Worker {worker} running job {job['id']}: {job['chapter']} ({job['interest']}, {job['strategy']}, attempt {job['attempts']})")
+        receiver, sender = Pipe(duplex=False)
+        process = Process(target=run_job, args=(args, job, sender))
+        process.start()
+        sender.close()
+
+        # The worker heartbeats while its job runs; once another worker has reclaimed the job, this copy must stop writing to its save_dir
+        lost = False
+        process.join(args.heartbeat)
+        while process.is_alive():
+            if not queue.heartbeat(job["id"], worker):
+                logger.warning(f"Job {job['id']} was reclaimed by another worker; stopping it")
+                process.terminate()
+                lost = True
+            process.join(args.heartbeat)
+
+        try:
+            error = receiver.recv()
+        except EOFError:
+            # Killed, or died before it could report
+            error = f"Job process exited with code {process.exitcode}"
+        receiver.close()
+        if lost:
+            continue
+        # Reclaimed between the last heartbeat and now: the job's state belongs to the worker that took it over
+        recorded = queue.finish(job["id"], worker, job["save_dir"]) if error is None else queue.fail(job["id"], worker, error)
+        if not recorded:
+            logger.warning(f"Job {job['id']} was reclaimed by another worker before its result could be recorded; its lease was lost")
+
+    queue.close()
+
+
+def status(queue:JobQueue) -> None:
+    progress = queue.progress()
+    eta = str(timedelta(seconds=progress["eta_seconds"])) if progress["eta_seconds"] is not None else "unknown"
+    print(f"{progress['done']}/{progress['total']} done, {progress['running']} running on {progress['workers']} workers, {progress['pending']} pending, {progress['failed']} failed")
+    print(f"{progress['jobs_per_minute']:.2f} jobs/min, ETA {eta}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", help="init: queue every chapter x interest x strategy; work: run jobs until the queue is empty; status: progress and ETA; retry: requeue failed jobs", choices=["init", "work", "status", "retry"])
+    parser.add_argument("--db", dest="db", help="Queue database; put it on the filesystem every worker shares", default="output/queue.db")
+    parser.add_argument("-s", "--strategies", dest="strategies", nargs="+", help="Strategies to queue", default=["complete"], choices=list(STRATEGIES.keys()))
+    parser.add_argument("-i", "--interests", dest="interests", nargs="+", help="Interests to queue", default=INTERESTS)
+    parser.add_argument("--textbook", dest="textbook", help="Folder whose Markdown files are queued", default="og-textbooks/berkeley-cs61b")
+    parser.add_argument("--shards", dest="shards", help="Number of shards jobs are spread over", type=int, default=1)
+    parser.add_argument("--shard", dest="shard", help="Shard this machine's workers prefer before stealing from others", type=int, default=None)
+    parser.add_argument("-j", "--workers", dest="workers", help="Worker processes started on this machine", type=int, default=1)
+    parser.add_argument("--heartbeat", dest="heartbeat", help="Seconds between worker heartbeats", type=float, default=30)
+    parser.add_argument("--stale-after", dest="stale_after", help="Seconds without a heartbeat before a running job is reclaimed", type=float, default=300)
+    parser.add_argument("--max-attempts", dest="max_attempts", help="Attempts per job before it is marked failed", type=int, default=3)
+    parser.add_argument("-w", "--section-workers", dest="section_workers", help="Number of sections refined concurrently within each job", type=int, default=8)
+    parser.add_argument("--stage-workers", dest="stage_workers", help="Number of independent stages run concurrently within each job", type=int, default=4)
+    parser.add_argument("--sectioner", dest="sectioner", help="How drafts are split into sections", default="llm", choices=["llm", "markdown"])
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", help="Personalize and judge chapters over this many tokens chunk by chunk (map-reduce)", type=int, default=None)
+    parser.add_argument("--analogy-store", dest="analogy_store", help="JSONL file of analogies reused across chapters and runs", default=None)
+    parser.add_argument("--watch", dest="watch", help="With status, refresh every this many seconds", type=float, default=None)
+    add_runtime_args(parser)
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db, stale_after=args.stale_after, max_attempts=args.max_attempts)
+    if args.command == "init":
+        files = sorted(str(path) for path in Path(args.textbook).rglob("*.md"))
+        added = queue.add([(src, interest, strategy) for strategy in args.strategies for interest in args.interests for src in files], shards=args.shards)
+        logger.info(f"Queued {added} new jobs ({len(files)} files x {len(args.interests)} interests x {len(args.strategies)} strategies) in {args.db}")
+    elif args.command == "retry":
+        logger.info(f"Requeued {queue.retry_failed()} failed jobs")
+    elif args.command == "status":
+        status(queue)
+        while args.watch:
+            time.sleep(args.watch)
+            status(queue)
+    else:
+        queue.close()
+        processes = [Process(target=work, args=(args, index)) for index in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,32 @@
+from eval import Tournament
+from pipeline import client, llm
+from pipeline.MockBackend import MockBackend
+from pipeline.ResponseCache import ResponseCache
+
+
+def test_replicates_are_sampled_separately_with_a_cache(tmp_path):
+    paths = []
+    for name in ["one", "two"]:
+        path = tmp_path / name / "B" / "final_draft.md"
+        path.parent.mkdir(parents=True)
+        path.write_text(f"# Tries\n\nA draft named {name}.", encoding="utf-8")
+        paths.append(str(path))
+
+    backend = MockBackend()
+    client.set_client(backend.client())
+    llm.set_cache(ResponseCache(str(tmp_path / "cache")))
+    try:
+        tournament = Tournament(paths, "astronomy", str(tmp_path / "evals"), replicates=3, workers=2)
+        tournament.run()
+        requests = backend.stats()["requests"]
+
+        # A rerun of the same tournament is answered from the cache, replicate by replicate
+        Tournament(paths, "astronomy", str(tmp_path / "evals"), replicates=3, workers=2).run()
+    finally:
+        llm.set_cache(None)
+        client.set_client(None)
+
+    # One score per draft plus both orders of every replicate, each sent to the backend
+    assert len(tournament.matches) == 6
+    assert requests == 2 + 6
+    assert backend.stats()["requests"] == requests
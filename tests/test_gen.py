@@ -0,0 +1,50 @@
+import json
+
+from gen import incremental
+from pipeline import client
+from pipeline.MockBackend import MockBackend
+
+
+SECTIONS = [
+    "# Chapter intro\n\nData structures organize data.",
+    "## Arrays\n\nArrays store items contiguously.",
+    "## Linked Lists\n\nLinked lists chain nodes together.",
+    "## Hash Tables\n\nHash tables map keys to buckets.",
+    "## Trees\n\nTrees keep items in a hierarchy.",
+]
+
+
+def test_incremental_rerun_keeps_unchanged_sections_in_order(tmp_path, monkeypatch):
+    # Run directories are resolved relative to the working directory, as from the repo root
+    monkeypatch.chdir(tmp_path)
+    chapter = tmp_path / "og-textbooks" / "course" / "chapter.md"
+    chapter.parent.mkdir(parents=True)
+    chapter.write_text("\n\n".join(SECTIONS), encoding="utf-8")
+    src = "og-textbooks/course/chapter.md"
+
+    client.set_client(MockBackend().client())
+    try:
+        first_dir = incremental(src, "astronomy", "no_feedback", save_dir="output/course/chapter/1", sectioner="markdown")
+        chapter.write_text("\n\n".join(SECTIONS[:3] + ["## Hash Tables\n\nHash tables map keys to buckets by hashing them."] + SECTIONS[4:]), encoding="utf-8")
+        second_dir = incremental(src, "astronomy", "no_feedback", save_dir="output/course/chapter/2", sectioner="markdown")
+    finally:
+        client.set_client(None)
+
+    with open(f"{first_dir}/sections.json", "r", encoding="utf-8") as file:
+        first = [entry["final"] for entry in json.load(file)]
+    with open(f"{second_dir}/sections.json", "r", encoding="utf-8") as file:
+        second = json.load(file)
+
+    # The first run seeds every section from one whole-chapter run, paired back to the reference by heading
+    assert not (tmp_path / first_dir / "sections").exists()
+    assert [final.splitlines()[0] for final in first if final] == [section.splitlines()[0] for section, final in zip(SECTIONS, first) if final]
+
+    # Only the edited section is regenerated; the rest, empty ones included, are reused as they were
+    assert sorted(path.name for path in (tmp_path / second_dir / "sections").iterdir()) == ["003"]
+    assert [entry["final"] for i, entry in enumerate(second) if i != 3] == [final for i, final in enumerate(first) if i != 3]
+    assert "by hashing them" in second[3]["final"]
+
+    # The spliced chapter keeps every reused section byte for byte, in reference order; empty ones keep their reference text
+    references = SECTIONS[:3] + ["## Hash Tables\n\nHash tables map keys to buckets by hashing them."] + SECTIONS[4:]
+    with open(f"{second_dir}/B/final_draft.md", "r", encoding="utf-8") as file:
+        assert file.read() == "".join(f"{(entry['final'] or reference).strip()}\n\n" for entry, reference in zip(second, references))
@@ -0,0 +1,84 @@
+from threading import Thread
+from types import SimpleNamespace
+
+from pipeline import RateLimiter as rate_limiter
+from pipeline.RateLimiter import RateLimiter
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def blocked(limiter:RateLimiter, prompt_tokens:int=0) -> Thread:
+    # An acquire on its own thread; it stays alive for as long as the limiter holds it back
+    thread = Thread(target=limiter.acquire, args=(prompt_tokens,), daemon=True)
+    thread.start()
+    thread.join(0.05)
+    return thread
+
+
+def test_token_buckets_hold_requests_to_the_limit(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic))
+    limiter = RateLimiter(rpm=60, tpm=1000, completion_ratio=1.0)
+
+    # A full minute of requests goes out at once, then one more has to wait for the bucket to refill (1 request/s)
+    for _ in range(60):
+        limiter.acquire(1)
+        limiter.release(1, used_tokens=2)
+    thread = blocked(limiter, 1)
+    assert thread.is_alive()
+
+    clock.now += 1.0
+    with limiter.condition:
+        limiter.condition.notify_all()
+    thread.join(1.0)
+    assert not thread.is_alive()
+    assert limiter.stats()["calls"] == 61
+
+    # Tokens are charged on prompt plus expected completion and refunded down to the actual usage
+    clock.now += 60.0
+    limiter.acquire(200)
+    assert limiter.stats()["tokens_available"] == 600
+    limiter.release(200, used_tokens=250)
+    assert limiter.stats()["tokens_available"] == 750
+
+
+def test_concurrency_halves_on_429s_and_recovers(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic))
+    limiter = RateLimiter(max_concurrency=8)
+
+    # Every 429 halves the concurrency limit and backs off until retry-after has passed
+    for limit in [4, 2, 1]:
+        limiter.acquire(0)
+        assert limiter.throttled({"retry-after-ms": "500"}, attempt=0) == 0.5
+        assert limiter.stats()["concurrency_limit"] == limit
+        thread = blocked(limiter)
+        assert thread.is_alive()
+        clock.now += 0.5
+        with limiter.condition:
+            limiter.condition.notify_all()
+        thread.join(1.0)
+        assert not thread.is_alive()
+        limiter.release(0)
+
+    # Held to the lowered limit: a second call waits for the first
+    limiter.acquire(0)
+    thread = blocked(limiter)
+    assert thread.is_alive()
+    limiter.release(0, used_tokens=0)
+    thread.join(1.0)
+    assert not thread.is_alive()
+    limiter.release(0, used_tokens=0)
+
+    # Additive increase back to the cap after enough successful calls
+    for _ in range(100):
+        limiter.acquire(0)
+        limiter.release(0, used_tokens=0)
+    assert limiter.stats()["concurrency_limit"] == 8
+    assert limiter.stats()["active"] == 0
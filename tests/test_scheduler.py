@@ -0,0 +1,59 @@
+import json
+import time
+
+from threading import Lock
+
+from pipeline.Scheduler import Scheduler, Stage, dependencies
+
+
+class Recorder():
+    # Stands in for Checkpoint: runs every stage and records the order stages started and finished in
+    def __init__(self):
+        self.lock = Lock()
+        self.events = []
+
+    def run(self, name:str, fn, *args, inputs:list, outputs:list) -> None:
+        with self.lock:
+            self.events.append(("start", name))
+        fn(*args)
+        with self.lock:
+            self.events.append(("end", name))
+
+
+def stages() -> list:
+    return [
+        Stage("A.extract_concepts", time.sleep, 0.05, inputs=["A.reference_text"], outputs=["A.concepts"]),
+        Stage("B.personalize", time.sleep, 0.2, inputs=["B.reference_text"], outputs=["B.draft"]),
+        Stage("B.insert_analogies", time.sleep, 0.05, inputs=["A.concepts", "B.draft"], outputs=["B.draft"]),
+        Stage("B.finalize", time.sleep, 0.0, inputs=["B.draft"], outputs=["B.final_draft"]),
+        Stage("A.reload", time.sleep, 0.0, inputs=[], outputs=["A.reference_text"]),
+    ]
+
+
+def test_dependencies_follow_reads_and_writes():
+    assert dependencies(stages()) == {
+        "A.extract_concepts": set(),
+        "B.personalize": set(),
+        # Reads what both earlier stages wrote, and rewrites B.draft
+        "B.insert_analogies": {"A.extract_concepts", "B.personalize"},
+        "B.finalize": {"B.personalize", "B.insert_analogies"},
+        # Overwrites what an earlier stage reads
+        "A.reload": {"A.extract_concepts"},
+    }
+
+
+def test_stages_run_after_their_dependencies_and_report_the_critical_path(tmp_path):
+    ckpt = Recorder()
+    Scheduler(ckpt, str(tmp_path), workers=4).run(stages())
+
+    position = {event: i for i, event in enumerate(ckpt.events)}
+    for name, deps in dependencies(stages()).items():
+        assert all(position[("end", dep)] < position[("start", name)] for dep in deps)
+
+    # Independent stages overlap: personalize starts before extract_concepts finishes
+    assert position[("start", "B.personalize")] < position[("end", "A.extract_concepts")]
+
+    with open(tmp_path / "schedule.json", "r", encoding="utf-8") as file:
+        report = json.load(file)
+    assert [step["stage"] for step in report["critical_path"]] == ["B.personalize", "B.insert_analogies", "B.finalize"]
+    assert report["stages"]["B.finalize"]["depends_on"] == ["B.insert_analogies", "B.personalize"]
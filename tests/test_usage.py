@@ -0,0 +1,35 @@
+import json
+
+from pathlib import Path
+
+from gen import main
+from pipeline import client
+from pipeline.MockBackend import MockBackend
+from pipeline.Usage import aggregate
+
+
+CHAPTER = str(Path(__file__).resolve().parents[1] / "og-textbooks/berkeley-cs61b/26.-prefix-operations-and-tries/26.4-summary.md")
+
+
+def test_resume_keeps_the_calls_of_earlier_attempts(tmp_path):
+    backend = MockBackend()
+    client.set_client(backend.client())
+    save_dir = str(tmp_path / "run")
+    try:
+        main(CHAPTER, "astronomy", "no_feedback", save_dir=save_dir, sectioner="markdown")
+        with open(f"{save_dir}/usage.json", "r", encoding="utf-8") as file:
+            first = json.load(file)
+
+        # Every stage is restored from the manifest, so the resume itself makes no calls
+        main(CHAPTER, "astronomy", "no_feedback", save_dir=save_dir, resume=True, sectioner="markdown")
+        with open(f"{save_dir}/usage.json", "r", encoding="utf-8") as file:
+            resumed = json.load(file)
+    finally:
+        client.set_client(None)
+
+    assert first["calls"] and backend.stats()["requests"] == len(first["calls"])
+    assert resumed["attempts"] == 2
+    assert resumed["calls"] == first["calls"]
+
+    summary = aggregate([save_dir], str(tmp_path / "report"))
+    assert sum(stage["calls"] for stage in summary.values()) == len(first["calls"])
@@ -1,8 +1,34 @@
+from functools import lru_cache
+from loguru import logger
+
+
 def read(src:str):
     with open(src, "r") as file:
         content = file.read().strip()
     return content
 
 
+@lru_cache(maxsize=None)
+def _encoding(model:str):
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # tiktoken downloads its BPE files on first use, which fails offline
+        logger.warning(f"tiktoken encoding for {model} unavailable; estimating tokens as len(text) / 4")
+        return None
+
+
+def count_tokens(text:str, model:str="gpt-4o-2024-08-06") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
 if __name__ == "__main__":
     pass